@@ -0,0 +1,132 @@
+from __future__ import annotations
+import os
+import asyncio
+import multiprocessing as mp
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from multiprocessing import shared_memory
+from typing import NamedTuple, Union
+
+import numpy as np
+from PIL import Image
+
+from detectors import OutlineDetector, phash_from_image
+
+class ShmCrop(NamedTuple):
+    """Ссылка на прямоугольник внутри кадра в shared memory (передаётся воркеру вместо пикселей)."""
+    name: str
+    shape: tuple[int, ...]
+    box: tuple[int, int, int, int]  # x0, y0, x1, y1
+
+CardSource = Union[bytes, np.ndarray, ShmCrop]
+
+class SharedFrame:
+    """Декодированный скриншот сетки в shared memory; воркеры читают карточки без копирования через pickle."""
+
+    def __init__(self, arr: np.ndarray):
+        self.shape = arr.shape
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=np.uint8, buffer=self.shm.buf)[...] = arr
+
+    def crop(self, box: tuple[int, int, int, int]) -> ShmCrop:
+        return ShmCrop(self.shm.name, self.shape, box)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+_detectors: dict[tuple[int, float], OutlineDetector] = {}
+
+def _detector(params: tuple[int, float]) -> OutlineDetector:
+    det = _detectors.get(params)
+    if det is None:
+        det = _detectors[params] = OutlineDetector(*params)
+    return det
+
+def _load(src: CardSource) -> np.ndarray:
+    """Пиксели карточки (RGB) из байтов PNG, массива или shared memory."""
+    if isinstance(src, ShmCrop):
+        shm = shared_memory.SharedMemory(name=src.name)
+        try:
+            x0, y0, x1, y1 = src.box
+            # Копия одной карточки, чтобы сразу отпустить буфер кадра
+            return np.ndarray(src.shape, dtype=np.uint8, buffer=shm.buf)[y0:y1, x0:x1].copy()
+        finally:
+            shm.close()
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return np.asarray(Image.open(BytesIO(src)).convert("RGB"))
+    return OutlineDetector.to_rgb(src)
+
+def _analyze_chunk(items: list[tuple[CardSource, bool]], params: tuple[int, float]) -> list[tuple[str | None, bool]]:
+    """Выполняется в воркере: карточки одного размера проверяются батчем, phash — только для нужных."""
+    det = _detector(params)
+    arrs = [_load(src) for src, _ in items]
+    flags = [False] * len(arrs)
+    by_shape: dict[tuple[int, ...], list[int]] = {}
+    for i, a in enumerate(arrs):
+        by_shape.setdefault(a.shape, []).append(i)
+    for group in by_shape.values():
+        for i, f in zip(group, det.detect_batch(np.stack([arrs[i] for i in group])).tolist()):
+            flags[i] = f
+
+    out: list[tuple[str | None, bool]] = []
+    for (_, force_hash), a, flag in zip(items, arrs, flags):
+        h = phash_from_image(Image.fromarray(a)) if (flag or force_hash) else None
+        out.append((h, flag))
+    return out
+
+def _warmup() -> bool:
+    # Тяжёлые импорты детекторов — в воркере заранее, а не на первой карточке
+    import cv2, imagehash  # noqa: F401
+    return True
+
+class AnalysisExecutor:
+    """Выносит phash и поиск обводки с event loop: process | thread | sync.
+
+    analyze()/analyze_many() возвращают (phash, border_flag); phash равен None,
+    если карточка без обводки и хеш не запрошен явно (force_hash).
+    """
+
+    def __init__(self, kind: str = "process", workers: int = 0,
+                 edge_band_px: int = 14, edge_density_threshold: float = 0.08):
+        if kind not in ("process", "thread", "sync"):
+            raise ValueError(f"Unknown analysis executor: {kind!r} (expected process, thread or sync)")
+        self.kind = kind
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.params = (edge_band_px, edge_density_threshold)
+        self._pool: Executor | None = None
+
+    async def start(self):
+        if self.kind == "process" and self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"))
+            # Поднимаем воркеры заранее, чтобы первый скан не платил за spawn
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self._pool, _warmup) for _ in range(self.workers)))
+        elif self.kind == "thread" and self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="analysis")
+
+    def share(self, frame: np.ndarray) -> SharedFrame | None:
+        """Кладёт кадр в shared memory, если пиксели нужно отдавать в другие процессы."""
+        return SharedFrame(frame) if self.kind == "process" else None
+
+    async def analyze(self, src: CardSource, force_hash: bool = False) -> tuple[str | None, bool]:
+        return (await self.analyze_many([(src, force_hash)]))[0]
+
+    async def analyze_many(self, items: list[tuple[CardSource, bool]]) -> list[tuple[str | None, bool]]:
+        if not items:
+            return []
+        if self.kind == "sync":
+            return _analyze_chunk(items, self.params)
+        if self._pool is None:
+            await self.start()
+
+        loop = asyncio.get_running_loop()
+        size = max(1, -(-len(items) // (self.workers * 2)))
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        parts = await asyncio.gather(*(loop.run_in_executor(self._pool, _analyze_chunk, c, self.params) for c in chunks))
+        return [r for part in parts for r in part]
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
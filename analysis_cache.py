@@ -0,0 +1,87 @@
+from __future__ import annotations
+import os
+import json
+import asyncio
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+class AnalysisCache:
+    """LRU результатов анализа карточки (phash, обводка, цена) по отпечатку её DOM.
+
+    Отпечаток считает CARDS_META_JS из текста, атрибутов и src картинок карточки, так что
+    неизменившаяся карточка не требует ни скриншота, ни хеширования. params — параметры
+    детектора: при их смене сохранённый кэш не используется, как и при смене FORMAT
+    (формат записи или разбор текста карточки, например цены).
+    """
+
+    FORMAT = 2
+
+    def __init__(self, path: str | None = None, capacity: int = 4096, params: Any = None):
+        self.path = Path(path) if path else None
+        self.capacity = max(1, capacity)
+        self.params = list(params) if isinstance(params, tuple) else params
+        self._entries: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._dirty = False
+        self._save_lock = threading.Lock()
+        self._snapshot_seq = 0
+        self._written_seq = 0
+        if self.path and self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("params") == self.params and data.get("format") == self.FORMAT:
+                    self._entries.update(data.get("entries", {}))
+                else:
+                    logger.info(f"Analysis cache {self.path} was built with other detector params or format, starting empty")
+            except Exception as e:
+                logger.warning(f"Analysis cache {self.path} is unreadable, starting empty: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, fp: str) -> dict[str, Any] | None:
+        entry = self._entries.get(fp)
+        if entry is not None:
+            self._entries.move_to_end(fp)
+        return entry
+
+    def put(self, fp: str, entry: dict[str, Any]):
+        self._entries[fp] = entry
+        self._entries.move_to_end(fp)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def save(self):
+        """Атомарная запись JSON (порядок записей = порядок LRU)."""
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            self._write(*snapshot)
+
+    async def save_async(self):
+        """Как save(), но JSON и запись — в потоке: снимок берётся на event loop, где меняется кэш."""
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            await asyncio.to_thread(self._write, *snapshot)
+
+    def _snapshot(self) -> tuple[int, dict[str, Any]] | None:
+        if not self.path or not self._dirty:
+            return None
+        self._dirty = False
+        self._snapshot_seq += 1
+        # Записи после put не меняются, так что копии словаря достаточно
+        return self._snapshot_seq, {"format": self.FORMAT, "params": self.params, "entries": dict(self._entries)}
+
+    def _write(self, seq: int, data: dict[str, Any]):
+        text = json.dumps(data, ensure_ascii=False)
+        with self._save_lock:
+            if seq < self._written_seq:
+                return  # более свежий снимок уже на диске
+            self._written_seq = seq
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp.write_text(text, encoding="utf-8")
+            os.replace(tmp, self.path)
@@ -0,0 +1,147 @@
+from __future__ import annotations
+import random
+import asyncio
+from typing import Any, AsyncIterator
+
+from loguru import logger
+
+from db import DailyBudget, GiftDB
+from metrics import metrics
+
+def _gift_info(g: Any) -> dict[str, Any]:
+    """Приводит подарок из high-level API (pyrofork/kurigram) или raw StarGift к одному виду."""
+    price = getattr(g, "price", None)
+    if price is None:
+        price = getattr(g, "stars", None)
+    remains = getattr(g, "available_amount", None)
+    if remains is None:
+        remains = getattr(g, "availability_remains", None)
+    limited = bool(getattr(g, "is_limited", False) or getattr(g, "limited", False))
+    sold_out = bool(getattr(g, "is_sold_out", False) or getattr(g, "sold_out", False)) or (limited and remains == 0)
+    title = getattr(g, "title", None)
+    return {"gift_id": int(g.id), "price": int(price) if price is not None else None,
+            "limited": limited, "sold_out": sold_out, "remains": remains, "title": title}
+
+class ApiGiftScanner:
+    """Сканер каталога подарков через MTProto (клиент Pyrogram из Notifier), без браузера.
+
+    Возвращает тот же формат, что и WebGiftScanner.run_scan; новизна определяется
+    по gift_id относительно таблицы catalog в GiftDB.
+    """
+
+    def __init__(self, client: Any, db: GiftDB):
+        self.client = client
+        self.db = db
+        self._catalog_hash = 0
+        self._catalog: list[dict[str, Any]] = []
+        self._reported: set[int] = set()  # уже сообщённые, но ещё не решённые (покупка не удалась или лимит)
+
+    async def fetch_catalog(self) -> list[dict[str, Any]]:
+        if hasattr(self.client, "get_available_gifts"):
+            gifts = await self.client.get_available_gifts()
+            self._catalog = [_gift_info(g) for g in gifts]
+            return self._catalog
+
+        from pyrogram.raw import functions
+        get_star_gifts = getattr(functions.payments, "GetStarGifts", None)
+        if get_star_gifts is None:
+            raise RuntimeError("Installed Pyrogram does not support star gifts (need a layer with payments.GetStarGifts)")
+        r = await self.client.invoke(get_star_gifts(hash=self._catalog_hash))
+        if hasattr(r, "gifts"):
+            self._catalog_hash = int(getattr(r, "hash", 0) or 0)
+            self._catalog = [_gift_info(g) for g in r.gifts]
+        return self._catalog
+
+    async def _buy(self, recipient_username: str, gift_id: int):
+        send_gift = getattr(self.client, "send_gift", None)
+        if send_gift is None:
+            raise RuntimeError("Client has no send_gift(); buying requires pyrofork/kurigram")
+        await send_gift(chat_id=recipient_username, gift_id=gift_id)
+
+    async def run_scan(self, recipient_username: str, buy_policy: dict[str, Any] | None = None) -> dict:
+        result: dict[str, Any] = {"new_border_cards": [], "screens": [], "bought": []}
+
+        with metrics.span("api.fetch_catalog"):
+            catalog = await self.fetch_catalog()
+        known = await self.db.known_gift_ids()
+        fresh = [g for g in catalog if g["gift_id"] not in known]
+        if not known:
+            # Первый запуск: запоминаем каталог как базовый, ничего не покупаем
+            if fresh:
+                await self.db.add_gift_ids(fresh)
+            logger.info(f"Gift catalog seeded with {len(fresh)} gifts")
+            return result
+
+        detected = []
+        for idx, g in enumerate(fresh, start=1):
+            if g["sold_out"]:
+                continue
+            detected.append({"idx": idx, "gift_id": g["gift_id"], "phash": None, "recipient": recipient_username,
+                             "dom_new": True, "border": g["limited"], "retry": g["gift_id"] in self._reported,
+                             "price": g["price"], "title": g["title"] or f"gift {g['gift_id']}"})
+        result["new_border_cards"] = detected
+        metrics.inc("detections", len(detected))
+
+        # В catalog попадают только решённые подарки: распроданные, купленные и отклонённые по цене.
+        # Ошибка покупки или дневной лимит оставляют подарок новым — следующий проход попробует снова.
+        settled = {g["gift_id"] for g in fresh if g["sold_out"]}
+
+        # === Покупка ===
+        if buy_policy and detected:
+            bought = []
+            budget: DailyBudget = buy_policy.get("budget") or DailyBudget(None, cap_left=buy_policy.get("daily_cap_left"))
+            buy_policy["budget"] = budget
+            max_price = int(buy_policy.get("max_price_stars", 10**9))
+
+            for d in detected:
+                price = d.get("price") or 0
+                if price <= 0 or price > max_price:
+                    settled.add(d["gift_id"])
+                    continue
+                reservation = await budget.reserve(price)
+                if reservation is None:
+                    logger.info(f"Skip buying gift_id={d['gift_id']}: daily cap would be exceeded by {price}⭐")
+                    continue
+                metrics.inc("buy_attempts")
+                try:
+                    with metrics.span("api.buy"):
+                        await self._buy(recipient_username, d["gift_id"])
+                except Exception as e:
+                    metrics.inc("buy_failures")
+                    await budget.release(reservation)
+                    logger.exception(f"API buy failed for gift_id={d['gift_id']}: {e}")
+                    continue
+                await budget.commit(reservation)
+                d["bought"] = True
+                bought.append(d)
+                settled.add(d["gift_id"])
+
+            result["bought"] = bought
+        else:
+            # Без автопокупки новинка только сообщается, повторять её незачем
+            settled.update(g["gift_id"] for g in fresh)
+
+        if settled:
+            await self.db.add_gift_ids([g for g in fresh if g["gift_id"] in settled])
+        self._reported = {d["gift_id"] for d in detected} - settled
+        return result
+
+    async def watch(self, recipient_username: str, buy_policy: dict[str, Any] | None = None,
+                    interval_sec: float = 20.0, jitter_sec: float = 5.0,
+                    max_failures: int = 5, **_: Any) -> AsyncIterator[dict]:
+        failures = 0
+        while True:
+            try:
+                res = await self.run_scan(recipient_username, buy_policy)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.exception(f"API watch pass failed ({failures}/{max_failures}): {e}")
+                if failures >= max_failures:
+                    raise
+                await asyncio.sleep(min(60.0, 2.0 ** failures))
+                continue
+
+            yield res
+
+            await asyncio.sleep(max(0.0, interval_sec + random.uniform(-jitter_sec, jitter_sec)))
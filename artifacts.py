@@ -0,0 +1,122 @@
+from __future__ import annotations
+import os
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import NamedTuple
+
+from loguru import logger
+
+from db import GiftDB
+from metrics import metrics
+
+class Artifact(NamedTuple):
+    id: int
+    sha256: str
+    path: str
+    size: int
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+def _unlink(paths: list[Path]):
+    for p in paths:
+        p.unlink(missing_ok=True)
+
+class ArtifactStore:
+    """Скриншоты и кропы карточек по хешу содержимого: root/ab/abcdef….ext, индекс — таблица artifacts.
+
+    Одинаковые байты пишутся один раз. Когда сумма размеров превышает max_bytes, давно
+    не использованные артефакты удаляются до low_water * max_bytes; закреплённые
+    (скриншоты покупок, на них ссылается purchases.artifact_id) не удаляются никогда.
+    """
+
+    def __init__(self, db: GiftDB, root: str, max_bytes: int = 512 * 1024 * 1024, low_water: float = 0.9):
+        self.db = db
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.total_bytes = 0
+        self._index: dict[str, tuple[int, str, int, bool]] = {}  # sha256 -> (id, ext, size, pinned)
+        self._lock = asyncio.Lock()
+        self._over_budget_warned = False
+
+    async def init(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        for artifact_id, sha, ext, size, pinned in await self.db.artifacts_index():
+            self._index[sha] = (artifact_id, ext, size, bool(pinned))
+        self.total_bytes = sum(size for _, _, size, _ in self._index.values())
+        logger.info(f"Artifact store {self.root}: {len(self._index)} files, {self.total_bytes / 2**20:.1f} MiB")
+        async with self._lock:
+            await self._evict()
+
+    def path_for(self, sha256: str, ext: str) -> Path:
+        return self.root / sha256[:2] / f"{sha256}.{ext}"
+
+    async def put(self, data: bytes, kind: str, name: str | None = None, ext: str = "png") -> Artifact:
+        sha = hashlib.sha256(data).hexdigest()
+        async with self._lock:
+            hit = self._index.get(sha)
+            if hit is not None:
+                artifact_id, ext, size, _ = hit
+                path = self.path_for(sha, ext)
+                self.db.touch_artifact(artifact_id)
+                metrics.inc("artifacts_deduplicated")
+                if not await asyncio.to_thread(path.exists):
+                    await asyncio.to_thread(_write_atomic, path, data)
+                return Artifact(artifact_id, sha, str(path), size)
+
+            path = self.path_for(sha, ext)
+            await asyncio.to_thread(_write_atomic, path, data)
+            artifact_id = await self.db.add_artifact(sha, kind, name, ext, len(data))
+            self._index[sha] = (artifact_id, ext, len(data), False)
+            self.total_bytes += len(data)
+            metrics.inc("artifacts_written")
+            metrics.inc("artifact_bytes_written", len(data))
+            await self._evict(keep=sha)
+        return Artifact(artifact_id, sha, str(path), len(data))
+
+    def find(self, path: str | None) -> int | None:
+        """id артефакта по пути, который вернул put (имя файла — хеш содержимого)."""
+        if not path:
+            return None
+        hit = self._index.get(Path(path).stem)
+        return hit[0] if hit is not None else None
+
+    def pin(self, artifact_id: int):
+        for sha, (aid, ext, size, pinned) in self._index.items():
+            if aid == artifact_id:
+                if not pinned:
+                    self._index[sha] = (aid, ext, size, True)
+                    self.db.pin_artifact(artifact_id)
+                return
+
+    async def _evict(self, keep: str | None = None):
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * self.low_water)
+        evicted = 0
+        while self.total_bytes > target:
+            rows = [r for r in await self.db.lru_artifacts(256) if r[1] != keep]
+            if not rows:
+                if not self._over_budget_warned:
+                    logger.warning(f"Artifact store is over budget ({self.total_bytes} > {self.max_bytes} bytes) "
+                                   f"with only pinned artifacts left")
+                    self._over_budget_warned = True
+                break
+            victims = []
+            for artifact_id, sha, ext, size in rows:
+                if self.total_bytes <= target:
+                    break
+                victims.append((artifact_id, self.path_for(sha, ext)))
+                self._index.pop(sha, None)
+                self.total_bytes -= size
+            await asyncio.to_thread(_unlink, [p for _, p in victims])
+            await self.db.delete_artifacts([i for i, _ in victims])
+            evicted += len(victims)
+        if evicted:
+            metrics.inc("artifacts_evicted", evicted)
+            logger.info(f"Evicted {evicted} artifacts, store now {self.total_bytes / 2**20:.1f} MiB")
@@ -0,0 +1,74 @@
+"""Сравнение старого пути has_orange_outline/has_border_visual с OutlineDetector.
+
+Запуск: python -m bench.detectors_bench [--cards 200] [--size 160] [--repeat 3]
+"""
+from __future__ import annotations
+import argparse
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from detectors import OutlineDetector, has_border_visual, has_orange_outline
+
+def make_cards(n: int, size: int, seed: int = 0) -> np.ndarray:
+    """Синтетические карточки: градиентный фон, треть с оранжевой рамкой, треть с серой."""
+    rng = np.random.default_rng(seed)
+    cards = np.empty((n, size, size, 3), dtype=np.uint8)
+    for i in range(n):
+        small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        img = Image.fromarray(small).resize((size, size), Image.BILINEAR)
+        draw = ImageDraw.Draw(img)
+        if i % 3 == 1:
+            draw.rectangle([2, 2, size - 3, size - 3], outline=(255, 140, 0), width=4)
+        elif i % 3 == 2:
+            draw.rectangle([3, 3, size - 4, size - 4], outline=(40, 40, 40), width=2)
+        cards[i] = np.asarray(img)
+    return cards
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def run(n: int = 200, size: int = 160, repeat: int = 3) -> dict:
+    cards = make_cards(n, size)
+    pil = [Image.fromarray(c) for c in cards]
+    det = OutlineDetector()
+
+    ref = [has_orange_outline(img) or has_border_visual(img) for img in pil]
+    single = [det.detect(img) for img in pil]
+    batch = det.detect_batch(cards).tolist()
+    if not (ref == single == batch):
+        raise AssertionError("OutlineDetector disagrees with the reference detectors")
+
+    t_ref = _best(lambda: [has_orange_outline(img) or has_border_visual(img) for img in pil], repeat)
+    t_single = _best(lambda: [det.detect(img) for img in pil], repeat)
+    t_batch = _best(lambda: det.detect_batch(cards), repeat)
+    return {
+        "cards": n, "size": size, "positives": sum(ref),
+        "reference_us_per_card": t_ref / n * 1e6,
+        "detector_us_per_card": t_single / n * 1e6,
+        "batch_us_per_card": t_batch / n * 1e6,
+        "speedup_single": t_ref / t_single,
+        "speedup_batch": t_ref / t_batch,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--cards", type=int, default=200)
+    ap.add_argument("--size", type=int, default=160)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    r = run(args.cards, args.size, args.repeat)
+    print(f"{r['cards']} cards {r['size']}x{r['size']}, {r['positives']} outlined")
+    print(f"reference : {r['reference_us_per_card']:8.1f} us/card")
+    print(f"detector  : {r['detector_us_per_card']:8.1f} us/card  (x{r['speedup_single']:.2f})")
+    print(f"batch     : {r['batch_us_per_card']:8.1f} us/card  (x{r['speedup_batch']:.2f})")
+
+if __name__ == "__main__":
+    main()
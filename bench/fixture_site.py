@@ -0,0 +1,193 @@
+"""Локальный фейковый Telegram Web для офлайн-бенчмарка WebGiftScanner.
+
+Повторяет путь сканера: меню → профиль → «Send a Gift» → поиск контакта → сетка
+из N карточек (каждая outlined_every-я с оранжевой обводкой) → диалог покупки →
+подтверждение → тост «Gift sent». Страница отправляет beacon на каждом этапе;
+сервер запоминает время прихода по time.perf_counter, так что раннер в том же
+процессе считает тайминги этапов от начала скана.
+
+Запуск отдельно (посмотреть глазами): python -m bench.fixture_site --port 8765
+"""
+from __future__ import annotations
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Telegram Web (fixture)</title>
+<style>
+  body { margin: 0; font: 14px sans-serif; background: #f4f4f5; }
+  #app { padding: 16px; }
+  button { font: inherit; padding: 8px 14px; margin: 4px; cursor: pointer; }
+  #catalog { display: grid; grid-template-columns: repeat(auto-fill, 150px); gap: 12px; }
+  .card { width: 150px; height: 170px; box-sizing: border-box; border: 4px solid transparent;
+          border-radius: 12px; display: flex; flex-direction: column; align-items: center;
+          justify-content: space-between; padding: 10px 4px; cursor: pointer; }
+  .card .pic { width: 72px; height: 72px; border-radius: 50%; }
+  .overlay { position: fixed; inset: 0; background: rgba(0,0,0,.35); display: flex;
+             align-items: center; justify-content: center; }
+  .dialog { background: #fff; border-radius: 12px; padding: 24px; min-width: 260px; text-align: center; }
+  .toast { position: fixed; bottom: 24px; left: 50%; transform: translateX(-50%); background: #333;
+           color: #fff; padding: 10px 18px; border-radius: 8px; pointer-events: none; }
+</style></head>
+<body><div id="app"></div>
+<script>
+const CFG = __CFG__;
+const app = document.getElementById("app");
+const mark = (stage) => navigator.sendBeacon("/beacon", stage);
+const later = (fn) => setTimeout(fn, CFG.latency_ms);
+
+function menu() {
+  app.innerHTML = '<button aria-label="Open menu">&#9776;</button>';
+  app.querySelector("button").onclick = () => later(sidebar);
+}
+function sidebar() {
+  mark("menu_opened");
+  app.innerHTML = '<a data-testid="AppSideBarProfile" href="#profile">My profile</a>';
+  app.querySelector("a").onclick = (e) => { e.preventDefault(); later(profile); };
+}
+function profile() {
+  mark("profile_opened");
+  app.innerHTML = '<button>Send a Gift</button>';
+  app.querySelector("button").onclick = () => later(search);
+}
+function search() {
+  mark("gift_picker_opened");
+  app.innerHTML = '<input type="text" placeholder="Search">';
+  app.querySelector("input").onkeydown = (e) => { if (e.key === "Enter") later(catalog); };
+}
+function catalog() {
+  const cards = [];
+  for (let i = 0; i < CFG.cards; i++) {
+    const hue = (i * 47) % 360;
+    const outlined = CFG.outlined_every > 0 && i % CFG.outlined_every === 0;
+    const border = outlined ? "border-color:#ff8c00;" : "";
+    cards.push('<div data-testid="gift-card" class="card" style="background:hsl(' + hue + ',40%,82%);' + border + '">'
+      + '<div class="pic" style="background:hsl(' + ((hue + 180) % 360) + ',55%,55%)"></div>'
+      + '<div>Gift #' + (i + 1) + '</div><div>\\u2B50 ' + CFG.price + '</div></div>');
+  }
+  app.innerHTML = '<div data-testid="gift-catalog" id="catalog">' + cards.join("") + '</div>';
+  app.querySelectorAll(".card").forEach((el) => el.onclick = () => later(() => buyDialog(el)));
+  mark("grid_rendered");
+}
+function buyDialog(card) {
+  mark("buy_dialog_opened");
+  const ov = document.createElement("div");
+  ov.className = "overlay";
+  ov.innerHTML = '<div class="dialog"><div>' + card.children[1].textContent + '</div><button>Send</button></div>';
+  document.body.appendChild(ov);
+  ov.querySelector("button").onclick = () => later(() => {
+    ov.querySelector(".dialog").innerHTML = '<button>Confirm \\u2B50 ' + CFG.price + '</button>';
+    ov.querySelector("button").onclick = () => { mark("confirm_clicked"); setTimeout(() => toast(ov), CFG.toast_ms); };
+  });
+}
+function toast(ov) {
+  ov.remove();
+  const t = document.createElement("div");
+  t.className = "toast";
+  t.textContent = "Gift sent";
+  document.body.appendChild(t);
+  mark("purchase_confirmed");
+  setTimeout(() => t.remove(), 1500);
+}
+document.addEventListener("DOMContentLoaded", () => { mark("page_loaded"); menu(); });
+</script></body></html>
+"""
+
+class FixtureSite:
+    """HTTP-сервер фикстуры в фоновом потоке; параметры каталога берутся из query string.
+
+    url(cards=48, outlined_every=4) — адрес страницы; marks() — этапы с момента reset().
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: int = 30, toast_ms: int = 250):
+        self.latency_ms = latency_ms
+        self.toast_ms = toast_ms
+        self._marks: list[tuple[str, float]] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                u = urlparse(self.path)
+                if not u.path.startswith("/k"):
+                    self.send_error(404)
+                    return
+                q = {k: v[-1] for k, v in parse_qs(u.query).items()}
+                cfg = {"cards": int(q.get("cards", 48)), "outlined_every": int(q.get("outlined_every", 4)),
+                       "price": int(q.get("price", 100)), "latency_ms": int(q.get("latency_ms", site.latency_ms)),
+                       "toast_ms": int(q.get("toast_ms", site.toast_ms))}
+                body = PAGE.replace("__CFG__", json.dumps(cfg)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                t = time.perf_counter()
+                stage = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8", "replace")
+                with site._lock:
+                    site._marks.append((stage, t))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, **params) -> str:
+        query = "&".join(f"{k}={v}" for k, v in params.items())
+        return f"{self.base_url}/k/" + (f"?{query}" if query else "")
+
+    def start(self) -> FixtureSite:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fixture-site", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self._marks.clear()
+
+    def marks(self) -> list[tuple[str, float]]:
+        with self._lock:
+            return list(self._marks)
+
+    def __enter__(self) -> FixtureSite:
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+    with FixtureSite(port=args.port) as site:
+        print(f"Serving {site.url(cards=48, outlined_every=4)} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
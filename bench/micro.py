@@ -0,0 +1,49 @@
+"""Микробенчмарки горячих функций: parse_price_stars, has_outline, phash_from_image.
+
+Запуск: python -m bench.micro [--cards 200] [--size 160] [--repeat 5]
+"""
+from __future__ import annotations
+import argparse
+
+from PIL import Image
+
+from bench.detectors_bench import _best, make_cards
+from detectors import has_outline, phash_from_image
+from web_scan import parse_price_stars
+
+PRICE_SAMPLES = [
+    # Как текст карточки из CARDS_META_JS: текстовые узлы через перевод строки
+    "Gift #12\n⭐ 1 500",
+    "Delicious Cake\n⭐ 350\nLimited\n1 of 10 000",
+    "Подарок\n2 500\nзвёзд",
+    "Sold out",
+]
+
+def run(n: int = 200, size: int = 160, repeat: int = 5) -> dict:
+    pil = [Image.fromarray(c) for c in make_cards(n, size)]
+    texts = PRICE_SAMPLES * 250
+
+    t_price = _best(lambda: [parse_price_stars(t) for t in texts], repeat)
+    t_outline = _best(lambda: [has_outline(img) for img in pil], repeat)
+    t_phash = _best(lambda: [phash_from_image(img) for img in pil], repeat)
+    return {
+        "cards": n, "size": size,
+        "parse_price_stars_us": t_price / len(texts) * 1e6,
+        "has_outline_us_per_card": t_outline / n * 1e6,
+        "phash_us_per_card": t_phash / n * 1e6,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--cards", type=int, default=200)
+    ap.add_argument("--size", type=int, default=160)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    r = run(args.cards, args.size, args.repeat)
+    print(f"parse_price_stars : {r['parse_price_stars_us']:8.2f} us/call")
+    print(f"has_outline       : {r['has_outline_us_per_card']:8.1f} us/card ({r['size']}x{r['size']})")
+    print(f"phash_from_image  : {r['phash_us_per_card']:8.1f} us/card")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Офлайн end-to-end бенчмарк WebGiftScanner против локального фейкового Telegram Web.
+
+Для каждого размера каталога: запуск браузера, холодный скан с покупкой (время до
+первой покупки, тайминги этапов по beacon'ам страницы) и повторный скан. Плюс
+микробенчмарки из bench.micro. Результат — JSON, который можно сравнить с прошлым
+коммитом через --compare.
+
+Запуск: python -m bench.run [--cards 12 48 120] [--repeat 3] [--buys 1]
+                             [--executor process] [--out bench/results/<commit>.json]
+                             [--compare bench/results/<old>.json]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from loguru import logger
+
+from analysis import AnalysisExecutor
+from bench import micro
+from bench.fixture_site import FixtureSite
+from db import DailyBudget
+from metrics import metrics
+from selector_cache import SelectorCache
+from shots import ScreenshotRing
+from web_scan import SUCCESS_TEXT, WebGiftScanner
+
+PRICE = 100
+RECIPIENT = "@bench"
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=Path(__file__).resolve().parent).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+def _stage_marks(marks: list[tuple[str, float]], t0: float) -> dict[str, float]:
+    """Первое появление каждого этапа, в мс от начала скана."""
+    first: dict[str, float] = {}
+    for stage, t in marks:
+        first.setdefault(stage, _ms(t - t0))
+    return first
+
+async def _one_run(site: FixtureSite, tmp: Path, cards: int, outlined_every: int, buys: int,
+                   executor: str, workers: int) -> dict:
+    analysis = AnalysisExecutor(executor, workers=workers)
+    await analysis.start()
+    shots_dir = str(tmp / "screenshots")
+    scanner = WebGiftScanner(
+        url=site.url(cards=cards, outlined_every=outlined_every, price=PRICE),
+        state_file=str(tmp / "state.json"), screenshots_dir=shots_dir, headless=True, timeout_sec=15,
+        screenshot_every_step=False, analysis=analysis, shots=ScreenshotRing(shots_dir), selector_cache=SelectorCache(),
+    )
+    policy = {"max_price_stars": PRICE, "budget": DailyBudget(None, cap_left=buys * PRICE),
+              "wait_success_ms": 5000, "success_text": SUCCESS_TEXT, "insufficient_text": []}
+    try:
+        t = time.perf_counter()
+        await scanner.start()
+        launch = time.perf_counter() - t
+
+        site.reset()
+        t0 = time.perf_counter()
+        res = await scanner.scan_once(RECIPIENT, policy if buys else None)
+        scan = time.perf_counter() - t0
+        marks = _stage_marks(site.marks(), t0)
+
+        # После покупки выбор подарка закрыт, так что повторный скан откроет его заново
+        site.reset()
+        reused_before = metrics.run_summary()["counters"].get("picker_reused", 0)
+        t1 = time.perf_counter()
+        await scanner.scan_once(RECIPIENT, None)
+        rescan = time.perf_counter() - t1
+        rescan_in_place = metrics.run_summary()["counters"].get("picker_reused", 0) > reused_before
+    finally:
+        await scanner.close(save_state=False)
+        analysis.shutdown()
+
+    grid = marks.get("grid_rendered")
+    first_buy = marks.get("buy_dialog_opened")
+    done = marks.get("purchase_confirmed")
+    return {
+        "launch_ms": _ms(launch),
+        "scan_ms": _ms(scan),
+        "navigate_ms": grid,
+        "analyze_ms": (first_buy if first_buy is not None else _ms(scan)) - grid if grid is not None else None,
+        "buy_ms": done - first_buy if done is not None and first_buy is not None else None,
+        "first_purchase_ms": done,
+        "rescan_ms": _ms(rescan),
+        "rescan_in_place": rescan_in_place,
+        "detected": len(res["new_border_cards"]),
+        "expected": len(range(0, cards, outlined_every)) if outlined_every > 0 else 0,
+        "bought": len(res["bought"]),
+        "marks": marks,
+    }
+
+def _median(runs: list[dict]) -> dict:
+    out = dict(runs[-1])
+    for key, value in runs[-1].items():
+        if isinstance(value, float):
+            vals = [r[key] for r in runs if r[key] is not None]
+            out[key] = round(statistics.median(vals), 1) if vals else None
+    return out
+
+async def run_e2e(sizes: list[int], repeat: int, buys: int, outlined_every: int,
+                  executor: str, workers: int) -> list[dict]:
+    results = []
+    with FixtureSite() as site, tempfile.TemporaryDirectory(prefix="gift-bench-") as tmp:
+        for cards in sizes:
+            runs = [await _one_run(site, Path(tmp), cards, outlined_every, buys, executor, workers) for _ in range(repeat)]
+            r = {"cards": cards, "runs": len(runs), **_median(runs)}
+            print(f"{cards:4d} cards: scan {r['scan_ms']} ms, first purchase {r['first_purchase_ms']} ms, "
+                  f"rescan {r['rescan_ms']} ms, detected {r['detected']}/{r['expected']}")
+            results.append(r)
+    return results
+
+def compare(base: dict, new: dict):
+    """Печатает изменения медиан относительно базового JSON (плюс — стало медленнее)."""
+    def line(name: str, a, b):
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool) and a:
+            print(f"  {name:28s} {a:10.1f} -> {b:10.1f}  ({(b - a) / a * 100:+.1f}%)")
+
+    print(f"Compare {base['meta']['commit']} -> {new['meta']['commit']}")
+    base_e2e = {r["cards"]: r for r in base.get("e2e", [])}
+    for r in new.get("e2e", []):
+        b = base_e2e.get(r["cards"])
+        if b is None:
+            continue
+        print(f" {r['cards']} cards")
+        for key in ("scan_ms", "navigate_ms", "analyze_ms", "buy_ms", "first_purchase_ms", "rescan_ms"):
+            line(key, b.get(key), r.get(key))
+    if base.get("micro") and new.get("micro"):
+        print(" micro")
+        for key, value in new["micro"].items():
+            if key.endswith("_us") or key.endswith("_us_per_card"):
+                line(key, base["micro"].get(key), value)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--cards", type=int, nargs="+", default=[12, 48, 120])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--buys", type=int, default=1, help="сколько карточек купить за холодный скан (0 — без покупок)")
+    ap.add_argument("--outlined-every", type=int, default=4)
+    ap.add_argument("--executor", choices=["process", "thread", "sync"], default="process")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--skip-e2e", action="store_true", help="только микробенчмарки (без браузера)")
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+    args = ap.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    commit = _git_commit()
+    report = {
+        "meta": {"commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "executor": args.executor, "workers": args.workers, "buys": args.buys,
+                 "outlined_every": args.outlined_every, "repeat": args.repeat},
+        "e2e": [],
+        "micro": micro.run(),
+    }
+    if not args.skip_e2e:
+        report["e2e"] = asyncio.run(run_e2e(args.cards, max(1, args.repeat), args.buys, args.outlined_every,
+                                            args.executor, args.workers))
+
+    out = Path(args.out or Path(__file__).resolve().parent / "results" / f"{commit}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Results written to {out}")
+
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+from typing import Any
+
+from loguru import logger
+from playwright.async_api import BrowserContext, Route
+
+from metrics import metrics
+
+WAIT_UNTIL = ("commit", "domcontentloaded", "load", "networkidle")
+
+BASE_ARGS = ["--disable-dev-shm-usage", "--no-sandbox"]
+
+DEFAULT_EXTRA_ARGS = [
+    "--mute-audio",
+    "--autoplay-policy=user-gesture-required",
+    "--disable-background-networking",
+    "--disable-extensions",
+]
+
+DEFAULT_BLOCK_PATTERNS = [
+    "**/*.{mp4,webm,mov,m4v}",
+    "**/*.{mp3,ogg,oga,opus,wav}",
+    "**/*.tgs",
+]
+
+class BrowserProfile:
+    """Облегчённый профиль Chromium: флаги запуска, reduced motion и блокировка ненужных запросов.
+
+    Блокировка работает на уровне контекста через context.route по glob-шаблонам URL:
+    шаблоны сверяет драйвер Playwright, в Python приходят только блокируемые запросы.
+    Фильтр по типу ресурса (media, font, ...) так не умеет — ему нужен маршрут "**/*",
+    через который идёт каждый запрос страницы, поэтому по умолчанию он выключен.
+    Заблокированное либо отдаётся пустым ответом 200 (stub_blocked, страница не ретраит),
+    либо обрывается. Медиа, которое Telegram Web качает по MTProto через websocket,
+    сюда не попадает.
+    """
+
+    def __init__(self, cfg: dict[str, Any] | None = None):
+        cfg = cfg or {}
+        self.wait_until = cfg.get("wait_until", "domcontentloaded")
+        if self.wait_until not in WAIT_UNTIL:
+            raise ValueError(f"Unknown wait_until: {self.wait_until!r} (expected one of {', '.join(WAIT_UNTIL)})")
+        self.reduced_motion = bool(cfg.get("reduced_motion", True))
+        self.block_types = frozenset(cfg.get("block_resource_types", []) or [])
+        if "document" in self.block_types:
+            raise ValueError("block_resource_types must not contain 'document'")
+        self.block_patterns = list(cfg.get("block_url_patterns", DEFAULT_BLOCK_PATTERNS) or [])
+        self.stub_blocked = bool(cfg.get("stub_blocked", True))
+        self.service_workers = cfg.get("service_workers", "allow")
+        self.launch_args = BASE_ARGS + [a for a in (cfg.get("extra_args", DEFAULT_EXTRA_ARGS) or []) if a not in BASE_ARGS]
+
+    def context_options(self) -> dict[str, Any]:
+        return {"reduced_motion": "reduce" if self.reduced_motion else "no-preference",
+                "service_workers": self.service_workers}
+
+    async def apply(self, context: BrowserContext):
+        # Маршруты, добавленные позже, проверяются раньше: шаблоны URL срабатывают до фильтра по типу
+        if self.block_types:
+            logger.warning("block_resource_types routes every request through the Python client and slows page load; "
+                           "prefer block_url_patterns")
+            await context.route("**/*", self._route_by_type)
+        for pattern in self.block_patterns:
+            await context.route(pattern, self._block)
+        if self.block_types or self.block_patterns:
+            logger.info(f"Blocking resource types {sorted(self.block_types)} and {len(self.block_patterns)} URL patterns")
+
+    async def _route_by_type(self, route: Route):
+        if route.request.resource_type in self.block_types:
+            await self._block(route)
+        else:
+            await route.continue_()
+
+    async def _block(self, route: Route):
+        metrics.inc("requests_blocked")
+        if self.stub_blocked:
+            await route.fulfill(status=200, body=b"")
+        else:
+            await route.abort("blockedbyclient")
@@ -1,7 +1,25 @@
 from __future__ import annotations
+import time
+import asyncio
+import itertools
 import aiosqlite
+from contextlib import asynccontextmanager
+from datetime import date
 from pathlib import Path
-from typing import Iterable
+from typing import AsyncIterator, Iterable
+
+from loguru import logger
+
+from phash_index import PhashIndex
+from metrics import metrics
+
+PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-8000;
+PRAGMA busy_timeout=5000;
+"""
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS gifts(
@@ -20,41 +38,341 @@ CREATE TABLE IF NOT EXISTS purchases(
   screenshot TEXT
 );
 CREATE INDEX IF NOT EXISTS purchases_dt_idx ON purchases(bought_at);
+
+CREATE TABLE IF NOT EXISTS catalog(
+  gift_id INTEGER PRIMARY KEY,
+  price_stars INTEGER,
+  limited INTEGER NOT NULL DEFAULT 0,
+  first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS spend_ledger(
+  day TEXT PRIMARY KEY,
+  spent_stars INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS spend_reservations(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  day TEXT NOT NULL,
+  amount INTEGER NOT NULL,
+  created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spend_reservations_day_idx ON spend_reservations(day);
+
+CREATE TABLE IF NOT EXISTS artifacts(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  sha256 TEXT NOT NULL UNIQUE,
+  kind TEXT NOT NULL,
+  name TEXT,
+  ext TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  pinned INTEGER NOT NULL DEFAULT 0,
+  created_at REAL NOT NULL,
+  last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_lru_idx ON artifacts(pinned, last_used);
 """
 
 class GiftDB:
-    def __init__(self, db_path: str):
+    """Одно долгоживущее соединение (WAL) и write-behind очередь для вставок.
+
+    add_hashes/add_purchase/add_gift_ids только ставят строки в очередь; фоновая
+    задача пишет накопившееся одной транзакцией. Чтения сначала дожидаются очереди.
+    """
+
+    def __init__(self, db_path: str, max_distance: int = 6, flush_interval: float = 0.05,
+                 reservation_ttl_sec: float = 600.0):
         self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.reservation_ttl_sec = reservation_ttl_sec
+        self.index = PhashIndex(max_distance)
+        # Купленные подарки отдельно и по получателю: неудавшаяся покупка попадает в gifts, но не сюда
+        # и повторяется; купленное одному получателю не мешает купить то же другому.
+        # Ключ None — покупки из баз до колонки recipient, они учитываются для всех получателей.
+        self.max_distance = max_distance
+        self._bought: dict[str | None, PhashIndex] = {}
+        self._index_last_id = 0
+        self._bought_last_id = 0
+        self._conn: aiosqlite.Connection | None = None
+        self._tx_lock = asyncio.Lock()
+        self._writes: asyncio.Queue[tuple[str, list[tuple]]] = asyncio.Queue()
+        self._flush_now = asyncio.Event()
+        self._writer: asyncio.Task | None = None
 
     async def init(self):
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.executescript(SCHEMA)
-            await db.commit()
+        # isolation_level=None: транзакции открываются явно в _transaction
+        self._conn = await aiosqlite.connect(self.db_path, isolation_level=None)
+        await self._conn.executescript(PRAGMAS)
+        await self._conn.executescript(SCHEMA)
+        await self._migrate()
+        await self._backfill_ledger()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    @asynccontextmanager
+    async def _transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """BEGIN IMMEDIATE: сразу берёт write-lock файла, так что проверка и запись атомарны и между процессами."""
+        async with self._tx_lock:
+            await self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                await self._conn.execute("COMMIT")
+            except BaseException:
+                await self._conn.execute("ROLLBACK")
+                raise
+
+    async def _migrate(self):
+        """Колонки, добавленные после создания таблиц: CREATE TABLE IF NOT EXISTS их не докатывает."""
+        async with self._conn.execute("PRAGMA table_info(purchases)") as cur:
+            columns = {row[1] for row in await cur.fetchall()}
+        if "artifact_id" not in columns:
+            await self._conn.execute("ALTER TABLE purchases ADD COLUMN artifact_id INTEGER REFERENCES artifacts(id)")
+        if "recipient" not in columns:
+            await self._conn.execute("ALTER TABLE purchases ADD COLUMN recipient TEXT")
+
+    async def _backfill_ledger(self):
+        """Однократно переносит траты из purchases в ledger для баз, созданных до его появления."""
+        async with self._transaction() as db:
+            async with db.execute("SELECT 1 FROM spend_ledger LIMIT 1") as cur:
+                if await cur.fetchone():
+                    return
+            await db.execute(
+                "INSERT INTO spend_ledger(day, spent_stars) "
+                "SELECT date(bought_at,'localtime'), SUM(COALESCE(price_stars,0)) FROM purchases GROUP BY 1"
+            )
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self._writes.get()]
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            while not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            try:
+                with metrics.span("db.write_batch"):
+                    async with self._transaction() as db:
+                        for sql, rows in batch:
+                            await db.executemany(sql, rows)
+                metrics.inc("db_rows_written", sum(len(rows) for _, rows in batch))
+            except Exception as e:
+                logger.exception(f"Write-behind batch of {len(batch)} statements failed: {e}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def _enqueue(self, sql: str, rows: list[tuple]):
+        if rows:
+            self._writes.put_nowait((sql, rows))
+
+    async def flush(self):
+        """Дожидается записи всего, что стоит в очереди."""
+        self._flush_now.set()
+        await self._writes.join()
+        self._flush_now.clear()
+
+    async def close(self):
+        if self._conn is None:
+            return
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        await self._conn.close()
+        self._conn = None
+
+    async def _fetchall(self, sql: str, params: tuple = ()) -> list:
+        await self.flush()
+        with metrics.span("db.read"):
+            async with self._conn.execute(sql, params) as cur:
+                return await cur.fetchall()
 
     async def known_hashes(self) -> set[str]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT phash FROM gifts") as cur:
-                rows = await cur.fetchall()
+        rows = await self._fetchall("SELECT phash FROM gifts")
         return {r[0] for r in rows}
 
+    async def refresh_index(self, batch: int = 5000):
+        """Догружает в index и bought только строки gifts/purchases, добавленные после прошлой загрузки (в т.ч. другими процессами)."""
+        while True:
+            rows = await self._fetchall(
+                "SELECT id, phash FROM gifts WHERE id > ? ORDER BY id LIMIT ?", (self._index_last_id, batch)
+            )
+            for row_id, h in rows:
+                self.index.add(h)
+            if rows:
+                self._index_last_id = rows[-1][0]
+            if len(rows) < batch:
+                break
+        while True:
+            rows = await self._fetchall(
+                "SELECT id, phash, recipient FROM purchases WHERE id > ? ORDER BY id LIMIT ?", (self._bought_last_id, batch)
+            )
+            for row_id, h, recipient in rows:
+                self._add_bought(recipient, h)
+            if rows:
+                self._bought_last_id = rows[-1][0]
+            if len(rows) < batch:
+                return
+
+    def _add_bought(self, recipient: str | None, phash: str):
+        if phash.startswith("gift:"):  # покупки api-бэкенда ключуются по gift_id, не по phash
+            return
+        index = self._bought.get(recipient)
+        if index is None:
+            index = self._bought[recipient] = PhashIndex(self.max_distance)
+        index.add(phash)
+
+    def is_bought(self, recipient: str | None, phash: str) -> bool:
+        """Куплен ли этому получателю подарок с близким phash (после refresh_index)."""
+        return any(index is not None and phash in index
+                   for index in (self._bought.get(recipient), self._bought.get(None)))
+
+    def find_similar(self, phash: str) -> str | None:
+        """Известный phash в пределах порога Хэмминга (после refresh_index) или None."""
+        x = self.index.find(phash)
+        return None if x is None else f"{x:016x}"
+
     async def add_hashes(self, hashes: Iterable[str]):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.executemany("INSERT OR IGNORE INTO gifts(phash) VALUES (?)", [(h,) for h in hashes])
-            await db.commit()
+        hashes = list(hashes)
+        self._enqueue("INSERT OR IGNORE INTO gifts(phash) VALUES (?)", [(h,) for h in hashes])
+        for h in hashes:
+            self.index.add(h)
 
-    async def add_purchase(self, phash: str, title: str | None, price_stars: int | None, screenshot: str | None):
-        async with aiosqlite.connect(self.db_path) as db:
+    async def known_gift_ids(self) -> set[int]:
+        rows = await self._fetchall("SELECT gift_id FROM catalog")
+        return {int(r[0]) for r in rows}
+
+    async def add_gift_ids(self, gifts: Iterable[dict]):
+        self._enqueue(
+            "INSERT OR IGNORE INTO catalog(gift_id, price_stars, limited) VALUES (?,?,?)",
+            [(g["gift_id"], g.get("price"), int(bool(g.get("limited")))) for g in gifts],
+        )
+
+    async def add_purchase(self, phash: str, title: str | None, price_stars: int | None, screenshot: str | None,
+                           artifact_id: int | None = None, recipient: str | None = None):
+        self._enqueue(
+            "INSERT INTO purchases(phash, title, price_stars, screenshot, artifact_id, recipient) VALUES (?,?,?,?,?,?)",
+            [(phash, title, price_stars, screenshot, artifact_id, recipient)],
+        )
+        self._add_bought(recipient, phash)
+
+    # === Артефакты (индекс для ArtifactStore) ===
+
+    async def artifacts_index(self) -> list[tuple[int, str, str, int, int]]:
+        return await self._fetchall("SELECT id, sha256, ext, size, pinned FROM artifacts")
+
+    async def add_artifact(self, sha256: str, kind: str, name: str | None, ext: str, size: int) -> int:
+        now = time.time()
+        async with self._transaction() as db:
             await db.execute(
-                "INSERT INTO purchases(phash, title, price_stars, screenshot) VALUES (?,?,?,?)",
-                (phash, title, price_stars, screenshot),
+                "INSERT OR IGNORE INTO artifacts(sha256, kind, name, ext, size, created_at, last_used) VALUES (?,?,?,?,?,?,?)",
+                (sha256, kind, name, ext, size, now, now),
             )
-            await db.commit()
+            async with db.execute("SELECT id FROM artifacts WHERE sha256 = ?", (sha256,)) as cur:
+                (artifact_id,) = await cur.fetchone()
+        return int(artifact_id)
+
+    def touch_artifact(self, artifact_id: int):
+        self._enqueue("UPDATE artifacts SET last_used = ? WHERE id = ?", [(time.time(), artifact_id)])
+
+    def pin_artifact(self, artifact_id: int):
+        self._enqueue("UPDATE artifacts SET pinned = 1 WHERE id = ?", [(artifact_id,)])
+
+    async def lru_artifacts(self, limit: int) -> list[tuple[int, str, str, int]]:
+        """Давно не использованные незакреплённые артефакты: (id, sha256, ext, size)."""
+        return await self._fetchall(
+            "SELECT id, sha256, ext, size FROM artifacts WHERE pinned = 0 ORDER BY last_used LIMIT ?", (limit,)
+        )
+
+    async def delete_artifacts(self, ids: list[int]):
+        async with self._transaction() as db:
+            await db.executemany("DELETE FROM artifacts WHERE id = ?", [(i,) for i in ids])
+
+    # === Дневной бюджет ===
 
     async def spent_today(self) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT COALESCE(SUM(price_stars),0) FROM purchases WHERE date(bought_at)=date('now','localtime')"
-            ) as cur:
-                row = await cur.fetchone()
-                return int(row[0] or 0)
+        rows = await self._fetchall("SELECT spent_stars FROM spend_ledger WHERE day = ?", (date.today().isoformat(),))
+        return int(rows[0][0]) if rows else 0
+
+    async def reserve(self, amount: int, daily_cap: int | None) -> int | None:
+        """Резервирует amount звёзд на сегодня; id резерва или None, если лимит будет превышен.
+
+        Просроченные резервы (упавший процесс) старше reservation_ttl_sec освобождаются.
+        """
+        day = date.today().isoformat()
+        now = time.time()
+        with metrics.span("db.reserve"):
+            async with self._transaction() as db:
+                await db.execute("DELETE FROM spend_reservations WHERE created_at < ?", (now - self.reservation_ttl_sec,))
+                if daily_cap:
+                    async with db.execute(
+                        "SELECT (SELECT COALESCE(SUM(spent_stars),0) FROM spend_ledger WHERE day = ?)"
+                        " + (SELECT COALESCE(SUM(amount),0) FROM spend_reservations WHERE day = ?)",
+                        (day, day),
+                    ) as cur:
+                        (used,) = await cur.fetchone()
+                    if used + amount > daily_cap:
+                        return None
+                cur = await db.execute(
+                    "INSERT INTO spend_reservations(day, amount, created_at) VALUES (?,?,?)", (day, amount, now)
+                )
+                return cur.lastrowid
+
+    async def commit_reservation(self, reservation_id: int):
+        """Покупка подтверждена: резерв превращается в трату в ledger."""
+        with metrics.span("db.commit_reservation"):
+            async with self._transaction() as db:
+                async with db.execute("SELECT day, amount FROM spend_reservations WHERE id = ?", (reservation_id,)) as cur:
+                    row = await cur.fetchone()
+                if row is None:
+                    logger.warning(f"Reservation {reservation_id} expired before commit")
+                    return
+                await db.execute("DELETE FROM spend_reservations WHERE id = ?", (reservation_id,))
+                await db.execute(
+                    "INSERT INTO spend_ledger(day, spent_stars) VALUES (?,?) "
+                    "ON CONFLICT(day) DO UPDATE SET spent_stars = spent_stars + excluded.spent_stars",
+                    row,
+                )
+
+    async def release_reservation(self, reservation_id: int):
+        with metrics.span("db.release_reservation"):
+            async with self._transaction() as db:
+                await db.execute("DELETE FROM spend_reservations WHERE id = ?", (reservation_id,))
+
+class DailyBudget:
+    """reserve/commit/release на каждую покупку: через ledger GiftDB или, без базы, по локальному остатку."""
+
+    def __init__(self, db: GiftDB | None, daily_cap: int | None = None, cap_left: int | None = None):
+        self.db = db
+        self.daily_cap = daily_cap or None
+        self._left = 10**9 if cap_left is None else cap_left
+        self._local: dict[int, int] = {}
+        self._tokens = itertools.count(1)
+
+    async def reserve(self, amount: int) -> int | None:
+        if self.db is not None:
+            return await self.db.reserve(amount, self.daily_cap)
+        if amount > self._left:
+            return None
+        self._left -= amount
+        token = next(self._tokens)
+        self._local[token] = amount
+        return token
+
+    async def commit(self, token: int):
+        if self.db is not None:
+            await self.db.commit_reservation(token)
+        else:
+            self._local.pop(token, None)
+
+    async def release(self, token: int):
+        if self.db is not None:
+            await self.db.release_reservation(token)
+        else:
+            self._left += self._local.pop(token, 0)
@@ -1,16 +1,82 @@
 from __future__ import annotations
 import os
+import time
+import argparse
 import asyncio
 import yaml
 from dotenv import load_dotenv
 from loguru import logger
 
-from utils import ensure_dirs, setup_logging
-from db import GiftDB
+from utils import ImportTimer, ensure_dirs, setup_logging, startup_report
+from db import DailyBudget, GiftDB
 from notifier import Notifier
-from web_scan import WebGiftScanner
+from metrics import metrics
+from artifacts import ArtifactStore
 
-async def main():
+async def build_buy_policy(cfg: dict, db: GiftDB) -> dict | None:
+    if not bool(cfg.get("auto_buy", False)):
+        return None
+
+    b = cfg.get("buy", {})
+    daily_cap = int(b.get("daily_cap_stars", 0))
+    skip_known = bool((cfg.get("dedup", {}) or {}).get("skip_known_on_buy", True))
+    return {
+        "max_price_stars": int(b.get("max_price_stars", 10**9)),
+        # Лимит проверяется резервом в ledger на каждую покупку, а не остатком на старте
+        "budget": DailyBudget(db, daily_cap),
+        "wait_success_ms": int(b.get("wait_success_ms", 6000)),
+        "success_text": b.get("success_text", ["Подарок отправлен", "Gift sent"]),
+        "insufficient_text": b.get("insufficient_text", ["Недостаточно", "Insufficient"]),
+        # Только купленное этому же получателю: не купленный (цена, лимит, ошибка) подарок пробуем снова
+        "is_bought": db.is_bought if skip_known else None,
+    }
+
+async def handle_result(res: dict, db: GiftDB, notifier: Notifier, report_empty: bool = True,
+                        artifacts: ArtifactStore | None = None):
+    detected = res["new_border_cards"] or []
+    if res.get("scan_error"):
+        await notifier.send_text(f"⚠️ Скан прерван после покупок: {res['scan_error']}")
+
+    hashed = [d for d in detected if d.get("phash")]
+    # Без phash (api-бэкенд) новизну уже проверил сканер по gift_id; retry — повторная попытка купить
+    really_new = [d for d in detected if not d.get("phash") and not d.get("retry")]
+    if hashed:
+        await db.refresh_index()
+        for d in hashed:
+            # Перерисовка карточки (hover, сглаживание) даёт близкий, но не равный phash
+            if db.find_similar(d["phash"]) is None:
+                db.index.add(d["phash"])
+                really_new.append(d)
+        new_hashes = [d["phash"] for d in really_new if d.get("phash")]
+        if new_hashes:
+            await db.add_hashes(new_hashes)
+
+    bought = res.get("bought", []) or []
+    if bought:
+        total = sum(d.get("price") or 0 for d in bought)
+        await notifier.send_text(f"🛒 Куплено подарков: {len(bought)} на {total}⭐")
+        for d in bought:
+            key = d.get("phash") or f"gift:{d['gift_id']}"
+            artifact_id = artifacts.find(d.get("buy_screen")) if artifacts is not None else None
+            if artifact_id is not None:
+                # Скриншот покупки — подтверждение траты: из store не вытесняется
+                artifacts.pin(artifact_id)
+            await db.add_purchase(key, d.get("title"), d.get("price"), d.get("buy_screen"), artifact_id, d.get("recipient"))
+            caption = f"✅ Куплен подарок idx={d['idx']} price={d.get('price')}⭐"
+            if d.get("buy_screen"):
+                await notifier.send_photo_with_caption(d["buy_screen"], caption)
+            else:
+                await notifier.send_text(caption)
+    else:
+        # В watch карточка с обводкой висит в сетке много проходов: сообщаем только о впервые увиденных
+        reportable = detected if report_empty else really_new
+        if reportable:
+            await notifier.send_text("ℹ️ Новинки найдены, но покупок нет (лимит/цена/баланс/ошибка).")
+        elif report_empty:
+            await notifier.send_text("🔍 Новых подарков с обводкой не найдено.")
+
+async def main(profile_startup: bool = False, import_timer: ImportTimer | None = None):
+    t_start = time.perf_counter()
     load_dotenv()
     with open("config.yaml", "r", encoding="utf-8") as f:
         cfg = yaml.safe_load(f)
@@ -18,76 +84,185 @@ async def main():
     setup_logging(cfg["paths"]["logs_dir"])
     ensure_dirs(cfg["paths"]["logs_dir"], cfg["paths"]["screenshots_dir"], "data")
 
+    m = cfg.get("metrics", {}) or {}
+    metrics.configure(
+        enabled=bool(m.get("enabled", True)),
+        prometheus_file=m.get("prometheus_file", "data/metrics/gift_scanner.prom"),
+        runs_dir=m.get("runs_dir", "data/metrics/runs"),
+        keep_runs=int(m.get("keep_runs", 100)),
+    )
+
     api_id = int(os.environ["API_ID"])
     api_hash = os.environ["API_HASH"]
     session_string = os.environ.get("SESSION_STRING", "").strip()
     admin_chat_id = int(os.environ["ADMIN_CHAT_ID"])
 
-    db = GiftDB(cfg["paths"]["db_file"])
-    await db.init()
+    db = GiftDB(cfg["paths"]["db_file"], max_distance=int((cfg.get("dedup", {}) or {}).get("max_distance", 6)))
+    art = cfg.get("artifacts", {}) or {}
+    artifacts = ArtifactStore(
+        db, cfg["paths"].get("artifacts_dir", "screenshots/artifacts"),
+        max_bytes=int(float(art.get("max_mb", 512)) * 1024 * 1024),
+    )
 
-    notifier = Notifier(session_string=session_string, api_id=api_id, api_hash=api_hash, admin_chat_id=admin_chat_id)
-    await notifier.start()
+    n = cfg.get("notify", {}) or {}
+    notifier = Notifier(
+        session_string=session_string, api_id=api_id, api_hash=api_hash, admin_chat_id=admin_chat_id,
+        coalesce_ms=int(n.get("coalesce_ms", 500)),
+        rate_per_sec=float(n.get("rate_per_sec", 1.0)),
+        burst=int(n.get("burst", 3)),
+        drain_timeout_sec=float(n.get("drain_timeout_sec", 15)),
+    )
 
+    analysis = None
+    scanner = None
     try:
-        scanner = WebGiftScanner(
-            url=cfg["telegram_web_url"],
-            state_file=cfg["paths"]["state_file"],
-            screenshots_dir=cfg["paths"]["screenshots_dir"],
-            headless=bool(cfg.get("headless", True)),
-            timeout_sec=int(cfg.get("timeout_sec", 25)),
-            screenshot_every_step=bool(cfg.get("screenshot_every_step", True))
-        )
-
-        spent = await db.spent_today()
-        daily_cap = int(cfg.get("buy", {}).get("daily_cap_stars", 0))
-        daily_left = max(0, daily_cap - spent) if daily_cap else 10**9
-
-        buy_policy = None
-        if bool(cfg.get("auto_buy", False)):
-            b = cfg.get("buy", {})
-            buy_policy = {
-                "max_price_stars": int(b.get("max_price_stars", 10**9)),
-                "daily_cap_left": daily_left,
-                "wait_success_ms": int(b.get("wait_success_ms", 6000)),
-                "insufficient_text": b.get("insufficient_text", ["Недостаточно", "Insufficient"]),
-            }
-
-        res = await scanner.run_scan(cfg["recipient_username"], buy_policy=buy_policy)
-        detected = res["new_border_cards"] or []
-
-        if detected:
-            known = await db.known_hashes()
-            really_new = [d for d in detected if d["phash"] not in known]
-            if really_new:
-                await db.add_hashes([d["phash"] for d in really_new])
-
-        bought = res.get("bought", []) or []
-        if bought:
-            total = sum(d.get("price") or 0 for d in bought)
-            await notifier.send_text(f"🛒 Куплено подарков: {len(bought)} на {total}⭐")
-            for d in bought:
-                await db.add_purchase(d["phash"], d.get("title"), d.get("price"), d.get("buy_screen"))
-                await notifier.send_photo_with_caption(d["buy_screen"], f"✅ Куплен подарок idx={d['idx']} price={d.get('price')}⭐")
-        else:
-            if detected:
-                await notifier.send_text("ℹ️ Новинки найдены, но покупок нет (лимит/цена/баланс/ошибка).")
+        backend = cfg.get("backend", "web")
+        if backend == "api":
+            pass  # ApiGiftScanner создаётся после старта Notifier: ему нужен его клиент
+        elif backend == "web":
+            # Тяжёлые модули (Playwright, numpy, PIL) грузим только для web-бэкенда
+            with metrics.span("startup.import_web"):
+                from web_scan import WebGiftScanner
+                from scan_pool import ScannerPool
+                from analysis import AnalysisExecutor
+                from shots import ScreenshotRing
+                from selector_cache import SelectorCache
+                from analysis_cache import AnalysisCache
+                from browser_profile import BrowserProfile
+
+            a, sc = cfg.get("analysis", {}) or {}, cfg.get("scan", {}) or {}
+            analysis = AnalysisExecutor(
+                kind=a.get("executor", "process"),
+                workers=int(a.get("workers", 0)),
+                edge_band_px=int(sc.get("edge_band_px", 14)),
+                edge_density_threshold=float(sc.get("edge_density_threshold", 0.08)),
+            )
+            s = cfg.get("screenshots", {}) or {}
+            shots = ScreenshotRing(
+                cfg["paths"]["screenshots_dir"],
+                capacity=int(s.get("ring_size", 20)),
+                fmt=s.get("format", "jpeg"),
+                quality=int(s.get("quality", 80)),
+                full_page=bool(s.get("full_page", False)),
+                persist_all=bool(s.get("persist_all", False)),
+                store=artifacts,
+            )
+            selector_cache = SelectorCache(cfg["paths"].get("selector_cache", "data/selectors.json"))
+            analysis_cache = AnalysisCache(
+                cfg["paths"].get("analysis_cache", "data/analysis_cache.json"),
+                capacity=int(sc.get("analysis_cache_size", 4096)),
+                params=analysis.params,
+            )
+            profile = BrowserProfile(cfg.get("browser", {}) or {})
+
+            def make_web_scanner(state_file: str) -> WebGiftScanner:
+                return WebGiftScanner(
+                    url=cfg["telegram_web_url"],
+                    state_file=state_file,
+                    screenshots_dir=cfg["paths"]["screenshots_dir"],
+                    headless=bool(cfg.get("headless", True)),
+                    timeout_sec=int(cfg.get("timeout_sec", 25)),
+                    screenshot_every_step=bool(cfg.get("screenshot_every_step", True)),
+                    scan_cfg=cfg.get("scan", {}),
+                    analysis=analysis,
+                    shots=shots,
+                    selector_cache=selector_cache,
+                    analysis_cache=analysis_cache,
+                    profile=profile,
+                )
+
+            accounts = cfg.get("accounts") or []
+            if accounts:
+                scanner = ScannerPool(
+                    [(make_web_scanner(acc["state_file"]), list(acc.get("recipients") or [cfg["recipient_username"]]))
+                     for acc in accounts],
+                    headless=bool(cfg.get("headless", True)),
+                    concurrency=int((cfg.get("pool", {}) or {}).get("concurrency", 2)),
+                )
             else:
-                await notifier.send_text("🔍 Новых подарков с обводкой не найдено.")
+                scanner = make_web_scanner(cfg["paths"]["state_file"])
+        else:
+            raise ValueError(f"Unknown scan backend: {backend!r} (expected 'api' or 'web')")
+
+        # База, клиент Telegram и браузер поднимаются одновременно
+        async def start_db():
+            with metrics.span("startup.db"):
+                await db.init()
+                await db.refresh_index()
+                await artifacts.init()
+
+        async def start_notifier():
+            with metrics.span("startup.notifier"):
+                await notifier.start()
+
+        async def start_scanner():
+            with metrics.span("startup.scanner"):
+                await asyncio.gather(analysis.start(), scanner.start())
+
+        # Браузер первым: его процессы запускаются, пока импортируется pyrogram
+        startups = ([start_scanner()] if backend == "web" else []) + [start_db(), start_notifier()]
+        errors = [r for r in await asyncio.gather(*startups, return_exceptions=True) if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        if backend == "api":
+            from api_scan import ApiGiftScanner
+            scanner = ApiGiftScanner(notifier.app, db)
+        metrics.observe("startup", time.perf_counter() - t_start)
+        logger.info(f"Startup finished in {(time.perf_counter() - t_start) * 1000:.0f} ms")
+        if profile_startup:
+            logger.info("Startup profile:\n" + startup_report(metrics, import_timer))
+
+        buy_policy = await build_buy_policy(cfg, db)
+
+        w = cfg.get("watch", {}) or {}
+        if bool(w.get("enabled", False)):
+            logger.info("Watch mode enabled")
+            async for res in scanner.watch(
+                cfg["recipient_username"], buy_policy=buy_policy,
+                interval_sec=float(w.get("interval_sec", 20)),
+                jitter_sec=float(w.get("jitter_sec", 5)),
+                state_flush_sec=float(w.get("state_flush_sec", 300)),
+                max_failures=int(w.get("max_failures", 5)),
+            ):
+                await handle_result(res, db, notifier, report_empty=False, artifacts=artifacts)
+                # Проход = всё с прошлого yield: скан, покупки, запись в базу
+                logger.info(f"Pass metrics: {metrics.end_run()['counters']}")
+                metrics.begin_run()
+        else:
+            res = await scanner.run_scan(cfg["recipient_username"], buy_policy=buy_policy)
+            await handle_result(res, db, notifier, artifacts=artifacts)
 
     except Exception as e:
         logger.exception("Scan failed")
         err_note = f"❌ Ошибка сканирования: {e}"
         await notifier.send_text(err_note)
         try:
-            from pathlib import Path
-            shots = sorted(Path("screenshots").glob("*.png"))
-            if shots:
-                await notifier.send_photo_with_caption(str(shots[-1]), err_note)
+            shots = getattr(scanner, "shots", None)
+            frame = shots.latest() if shots is not None else None
+            if frame is not None:
+                await notifier.send_photo_with_caption(frame.as_file(), err_note)
         except Exception:
             pass
     finally:
-        await notifier.stop()
+        if scanner is not None and hasattr(scanner, "close"):
+            # После run_scan/watch уже закрыт; здесь — если упали на старте
+            try:
+                await scanner.close(save_state=False)
+            except Exception:
+                pass
+        if analysis is not None:
+            analysis.shutdown()
+        try:
+            await notifier.stop()
+        except Exception:
+            logger.exception("Notifier stop failed")
+        await db.close()
+        metrics.end_run()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    ap = argparse.ArgumentParser(description="Telegram gift scanner")
+    ap.add_argument("--profile-startup", action="store_true",
+                    help="вывести время импортов (как -X importtime) и этапов старта")
+    args = ap.parse_args()
+    timer = ImportTimer().install() if args.profile_startup else None
+    asyncio.run(main(profile_startup=args.profile_startup, import_timer=timer))
@@ -0,0 +1,152 @@
+from __future__ import annotations
+import os
+import re
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+class _Histogram:
+    """Последние max_samples длительностей (для p50/p95) плюс точные count/sum/max за всё время."""
+
+    def __init__(self, max_samples: int):
+        self.samples: deque[float] = deque(maxlen=max_samples)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        s = sorted(self.samples)
+        return s[min(len(s) - 1, int(q * len(s)))]
+
+    def summary(self) -> dict[str, float]:
+        return {"count": self.count, "p50": self.quantile(0.5), "p95": self.quantile(0.95),
+                "max": self.max, "sum": self.sum}
+
+class Metrics:
+    """Длительности этапов (span/observe) и счётчики (inc) в памяти процесса.
+
+    Накопленное с запуска уходит в Prometheus textfile (для node_exporter), данные
+    одного прохода — в JSON: begin_run() начинает новый проход, end_run() пишет его.
+    В runs_dir остаются только keep_runs последних файлов.
+    """
+
+    def __init__(self, prefix: str = "gift", max_samples: int = 2048):
+        self.prefix = prefix
+        self.max_samples = max_samples
+        self.enabled = True
+        self.prometheus_file: Path | None = None
+        self.runs_dir: Path | None = None
+        self.keep_runs = 100
+        self._hist: dict[str, _Histogram] = {}
+        self._counters: dict[str, int] = {}
+        self._run_hist: dict[str, _Histogram] = {}
+        self._run_counters: dict[str, int] = {}
+        self._run_started = time.time()
+
+    def configure(self, enabled: bool = True, prometheus_file: str | None = None, runs_dir: str | None = None,
+                  keep_runs: int = 100):
+        self.enabled = enabled
+        self.prometheus_file = Path(prometheus_file) if prometheus_file else None
+        self.runs_dir = Path(runs_dir) if runs_dir else None
+        self.keep_runs = max(1, keep_runs)
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        for hist in (self._hist, self._run_hist):
+            h = hist.get(name)
+            if h is None:
+                h = hist[name] = _Histogram(self.max_samples)
+            h.observe(seconds)
+
+    def inc(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        self._counters[name] = self._counters.get(name, 0) + n
+        self._run_counters[name] = self._run_counters.get(name, 0) + n
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Замер блока кода; при исключении длительность тоже пишется и растёт счётчик <name>.errors."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f"{name}.errors")
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    # === Экспорт ===
+
+    def begin_run(self):
+        self._run_hist, self._run_counters = {}, {}
+        self._run_started = time.time()
+
+    def run_summary(self) -> dict[str, Any]:
+        return {
+            "started_at": self._run_started,
+            "duration_sec": time.time() - self._run_started,
+            "stages": {name: h.summary() for name, h in sorted(self._run_hist.items())},
+            "counters": dict(sorted(self._run_counters.items())),
+        }
+
+    def _metric_name(self, name: str) -> str:
+        return f"{self.prefix}_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+    def prometheus_text(self) -> str:
+        lat = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {lat} Duration of scan stages, DB queries and notifier sends.", f"# TYPE {lat} summary"]
+        for name, h in sorted(self._hist.items()):
+            for q in (0.5, 0.95):
+                lines.append(f'{lat}{{stage="{name}",quantile="{q}"}} {h.quantile(q):.6f}')
+            lines.append(f'{lat}_sum{{stage="{name}"}} {h.sum:.6f}')
+            lines.append(f'{lat}_count{{stage="{name}"}} {h.count}')
+        mx = f"{self.prefix}_stage_seconds_max"
+        lines += [f"# TYPE {mx} gauge"] + [f'{mx}{{stage="{name}"}} {h.max:.6f}' for name, h in sorted(self._hist.items())]
+        for name, value in sorted(self._counters.items()):
+            metric = self._metric_name(name) + "_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        """Атомарная запись textfile: node_exporter не должен увидеть файл наполовину."""
+        if not self.enabled or self.prometheus_file is None:
+            return
+        self.prometheus_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.prometheus_file.with_suffix(self.prometheus_file.suffix + ".tmp")
+        tmp.write_text(self.prometheus_text(), encoding="utf-8")
+        os.replace(tmp, self.prometheus_file)
+
+    def end_run(self) -> dict[str, Any]:
+        """Пишет JSON прохода и обновляет textfile; возвращает сводку прохода."""
+        summary = self.run_summary()
+        if not self.enabled:
+            return summary
+        if self.runs_dir is not None:
+            self.runs_dir.mkdir(parents=True, exist_ok=True)
+            name = time.strftime("run_%Y%m%d_%H%M%S", time.localtime(self._run_started))
+            name += f"_{int(self._run_started * 1000) % 1000:03d}"
+            (self.runs_dir / f"{name}.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+            self._prune_runs()
+        self.write_prometheus()
+        return summary
+
+    def _prune_runs(self):
+        # Имена run_YYYYmmdd_HHMMSS_mmm сортируются по времени
+        runs = sorted(self.runs_dir.glob("run_*.json"))
+        for p in runs[:-self.keep_runs]:
+            p.unlink(missing_ok=True)
+
+metrics = Metrics()
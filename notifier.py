@@ -1,18 +1,64 @@
 from __future__ import annotations
 import os
-from pyrogram import Client
+import time
+import asyncio
+from typing import TYPE_CHECKING, Any, BinaryIO
 from loguru import logger
 
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from pyrogram import Client
+
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+ALBUM_LIMIT = 10
+
+class _TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate = rate_per_sec
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
 class Notifier:
-    def __init__(self, session_string: str, api_id: int, api_hash: str, admin_chat_id: int):
+    """Отправка в админ-чат через фоновую очередь: send_* не ждут сети.
+
+    Сообщения, пришедшие в пределах coalesce_ms, склеиваются: тексты — в одно
+    сообщение, фото — в альбом. Запросы ограничены token bucket, FloodWait
+    пережидается. stop() дожидается очереди не дольше drain_timeout_sec.
+    """
+
+    def __init__(self, session_string: str, api_id: int, api_hash: str, admin_chat_id: int,
+                 coalesce_ms: int = 500, rate_per_sec: float = 1.0, burst: int = 3,
+                 max_retries: int = 5, drain_timeout_sec: float = 15.0):
         self.session_string = session_string
         self.api_id = api_id
         self.api_hash = api_hash
         self.admin_chat_id = admin_chat_id
         self.app: Client | None = None
+        self.coalesce_ms = coalesce_ms
+        self.max_retries = max_retries
+        self.drain_timeout_sec = drain_timeout_sec
+        self._bucket = _TokenBucket(rate_per_sec, burst)
+        self._queue: asyncio.Queue[tuple[str, Any, str]] = asyncio.Queue()
+        self._worker: asyncio.Task | None = None
 
     async def start(self):
-        self.app = Client(
+        # pyrogram импортируется только здесь (~0.5 с). Не в потоке: при импорте он берёт
+        # event loop текущего потока через asyncio.get_event_loop()
+        from pyrogram import Client
+        app = Client(
             name="session-bot",
             api_id=self.api_id,
             api_hash=self.api_hash,
@@ -20,18 +66,108 @@ class Notifier:
             workdir=os.getcwd(),
             no_updates=True
         )
-        await self.app.start()
+        await app.start()
+        # Только запущенный клиент: stop() на незапущенном падает, а send_* без клиента молча пропускаются
+        self.app = app
+        self._worker = asyncio.create_task(self._deliver_loop())
         logger.info("Pyrogram client started.")
 
     async def stop(self):
+        if self._worker:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout_sec)
+            except asyncio.TimeoutError:
+                logger.warning(f"Notifier queue not drained in {self.drain_timeout_sec}s, dropping {self._queue.qsize()} messages")
+                metrics.inc("notify_dropped", self._queue.qsize())
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
         if self.app:
             await self.app.stop()
             logger.info("Pyrogram client stopped.")
 
     async def send_text(self, text: str):
         if not self.app: return
-        await self.app.send_message(self.admin_chat_id, text)
+        self._queue.put_nowait(("text", text, ""))
 
-    async def send_photo_with_caption(self, photo_path: str, caption: str):
+    async def send_photo_with_caption(self, photo: str | BinaryIO, caption: str):
         if not self.app: return
-        await self.app.send_photo(self.admin_chat_id, photo=photo_path, caption=caption)
+        self._queue.put_nowait(("photo", photo, caption))
+
+    # === Доставка ===
+
+    async def _deliver_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.coalesce_ms / 1000)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                # Подряд идущие тексты — одно сообщение, подряд идущие фото — альбом; порядок сохраняется
+                groups: list[tuple[str, list]] = []
+                for kind, payload, caption in batch:
+                    if groups and groups[-1][0] == kind:
+                        groups[-1][1].append((payload, caption))
+                    else:
+                        groups.append((kind, [(payload, caption)]))
+                for kind, items in groups:
+                    if kind == "text":
+                        await self._deliver_texts([t for t, _ in items])
+                    else:
+                        await self._deliver_photos(items)
+            except Exception as e:
+                logger.exception(f"Notification delivery failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _call(self, fn, *args, **kwargs):
+        from pyrogram.errors import FloodWait
+        for attempt in range(1, self.max_retries + 1):
+            await self._bucket.acquire()
+            try:
+                with metrics.span(f"notify.{fn.__name__}"):
+                    return await fn(*args, **kwargs)
+            except FloodWait as e:
+                metrics.inc("notify_floodwaits")
+                wait = float(getattr(e, "value", 0) or 1)
+                logger.warning(f"FloodWait {wait}s on {fn.__name__} (attempt {attempt}/{self.max_retries})")
+                await asyncio.sleep(wait)
+            except Exception as e:
+                metrics.inc("notify_errors")
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"{fn.__name__} failed (attempt {attempt}/{self.max_retries}): {e}")
+                await asyncio.sleep(min(30.0, 2.0 ** attempt))
+        raise RuntimeError(f"{fn.__name__}: still flood-limited after {self.max_retries} attempts")
+
+    async def _deliver_texts(self, texts: list[str]):
+        chunk = ""
+        for text in texts:
+            if chunk and len(chunk) + 1 + len(text) > TEXT_LIMIT:
+                await self._call(self.app.send_message, self.admin_chat_id, chunk)
+                chunk = ""
+            chunk = f"{chunk}\n{text}" if chunk else text[:TEXT_LIMIT]
+        if chunk:
+            await self._call(self.app.send_message, self.admin_chat_id, chunk)
+
+    async def _deliver_photos(self, items: list[tuple[str | BinaryIO, str]]):
+        from pyrogram.types import InputMediaPhoto
+        for i in range(0, len(items), ALBUM_LIMIT):
+            album = items[i:i + ALBUM_LIMIT]
+
+            async def send_album(album=album):
+                # Файлы из памяти перематываем: повтор после FloodWait читает их заново
+                for photo, _ in album:
+                    if hasattr(photo, "seek"):
+                        photo.seek(0)
+                if len(album) == 1:
+                    photo, caption = album[0]
+                    return await self.app.send_photo(self.admin_chat_id, photo=photo, caption=caption[:CAPTION_LIMIT])
+                media = [InputMediaPhoto(photo, caption=caption[:CAPTION_LIMIT]) for photo, caption in album]
+                return await self.app.send_media_group(self.admin_chat_id, media)
+
+            await self._call(send_album)
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+def phash_to_int(h: str | int) -> int:
+    return h if isinstance(h, int) else int(h, 16)
+
+class PhashIndex:
+    """Поиск 64-битных phash в пределах расстояния Хэмминга (multi-index hashing).
+
+    Хеш делится на max_distance + 1 непересекающихся кусков: по принципу Дирихле
+    у хешей на расстоянии <= max_distance хотя бы один кусок совпадает точно,
+    поэтому кандидаты берутся из словарей по кускам, а не перебором всех хешей.
+    """
+
+    def __init__(self, max_distance: int = 6, bits: int = 64):
+        if not 0 <= max_distance < bits:
+            raise ValueError(f"max_distance must be in [0, {bits})")
+        self.max_distance = max_distance
+        self.bits = bits
+        m = max_distance + 1
+        widths = [bits // m + (1 if i < bits % m else 0) for i in range(m)]
+        self._chunks: list[tuple[int, int]] = []
+        shift = 0
+        for w in widths:
+            self._chunks.append((shift, (1 << w) - 1))
+            shift += w
+        self._tables: list[dict[int, list[int]]] = [{} for _ in self._chunks]
+        self._hashes: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, h: str | int) -> bool:
+        return self.find(h) is not None
+
+    def add(self, h: str | int) -> bool:
+        """Добавляет хеш; False, если ровно такой уже есть."""
+        x = phash_to_int(h)
+        if x in self._hashes:
+            return False
+        self._hashes.add(x)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((x >> shift) & mask, []).append(x)
+        return True
+
+    def find(self, h: str | int) -> int | None:
+        """Ближайший известный хеш в пределах max_distance или None."""
+        x = phash_to_int(h)
+        if x in self._hashes:
+            return x
+        best, best_d = None, self.max_distance + 1
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            for c in table.get((x >> shift) & mask, ()):
+                d = (x ^ c).bit_count()
+                if d < best_d:
+                    best, best_d = c, d
+        return best
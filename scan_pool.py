@@ -0,0 +1,134 @@
+from __future__ import annotations
+import time
+import random
+import asyncio
+from typing import Any, AsyncIterator
+
+from loguru import logger
+from playwright.async_api import async_playwright, Browser, Playwright
+
+from web_scan import WebGiftScanner, launch_browser
+
+class ScannerPool:
+    """Несколько аккаунтов (по BrowserContext на state_file) в одном процессе Chromium.
+
+    Аккаунты сканируются параллельно, но не больше concurrency одновременно; получатели
+    одного аккаунта — по очереди на его вкладке. Результаты сливаются в один формат
+    run_scan, у каждой карточки есть поля account и recipient.
+    """
+
+    def __init__(self, accounts: list[tuple[WebGiftScanner, list[str]]], headless: bool, concurrency: int = 2):
+        if not accounts:
+            raise ValueError("ScannerPool needs at least one account")
+        self.accounts = accounts
+        self.headless = headless
+        self.concurrency = max(1, concurrency)
+        self.shots = accounts[0][0].shots
+        self.profile = accounts[0][0].profile
+        self._pw: Playwright | None = None
+        self._browser: Browser | None = None
+
+    async def start(self):
+        if self._pw is None:
+            self._pw = await async_playwright().start()
+        if self._browser is None or not self._browser.is_connected():
+            self._browser = await launch_browser(self._pw, self.headless, self.profile)
+        await asyncio.gather(*(scanner.start(browser=self._browser) for scanner, _ in self.accounts))
+
+    async def save_state(self):
+        await asyncio.gather(*(scanner.save_state() for scanner, _ in self.accounts))
+
+    async def close(self, save_state: bool = True):
+        try:
+            await asyncio.gather(*(scanner.close(save_state=save_state) for scanner, _ in self.accounts),
+                                 return_exceptions=True)
+        finally:
+            if self._browser is not None:
+                await self._browser.close()
+            if self._pw is not None:
+                await self._pw.stop()
+            self._pw = self._browser = None
+
+    async def _scan_account(self, sem: asyncio.Semaphore, scanner: WebGiftScanner, recipients: list[str],
+                            buy_policy: dict[str, Any] | None) -> list[dict]:
+        results = []
+        async with sem:
+            for recipient in recipients:
+                try:
+                    res = await scanner.scan_once(recipient, buy_policy)
+                except Exception as e:
+                    logger.exception(f"Scan failed for {scanner.state_file} -> {recipient}: {e}")
+                    results.append({"error": f"{scanner.state_file} -> {recipient}: {e}"})
+                    try:
+                        await scanner.reconnect()
+                    except Exception:
+                        pass
+                    continue
+                for d in res["new_border_cards"]:
+                    d["account"], d["recipient"] = scanner.state_file, recipient
+                results.append(res)
+        return results
+
+    async def scan_all(self, buy_policy: dict[str, Any] | None = None) -> dict:
+        if self._browser is None or not self._browser.is_connected():
+            logger.warning("Shared browser is gone, relaunching")
+            self._browser = None
+            await self.start()
+
+        sem = asyncio.Semaphore(self.concurrency)
+        per_account = await asyncio.gather(*(
+            self._scan_account(sem, scanner, recipients, buy_policy) for scanner, recipients in self.accounts
+        ))
+
+        merged: dict[str, Any] = {"new_border_cards": [], "screens": [], "bought": [], "errors": []}
+        ok = 0
+        for res in (r for results in per_account for r in results):
+            if "error" in res:
+                merged["errors"].append(res["error"])
+                continue
+            ok += 1
+            if res.get("scan_error"):
+                merged["errors"].append(res["scan_error"])
+            merged["new_border_cards"] += res["new_border_cards"]
+            merged["screens"] += res["screens"]
+            merged["bought"] += res["bought"]
+        if merged["errors"] and not ok:
+            raise RuntimeError("All account scans failed: " + "; ".join(merged["errors"]))
+        return merged
+
+    async def run_scan(self, recipient_username: str | None = None, buy_policy: dict[str, Any] | None = None) -> dict:
+        """recipient_username не используется: у каждого аккаунта свой список получателей."""
+        await self.start()
+        try:
+            return await self.scan_all(buy_policy)
+        finally:
+            await self.close(save_state=True)
+
+    async def watch(self, recipient_username: str | None = None, buy_policy: dict[str, Any] | None = None,
+                    interval_sec: float = 20.0, jitter_sec: float = 5.0,
+                    state_flush_sec: float = 300.0, max_failures: int = 5) -> AsyncIterator[dict]:
+        await self.start()
+        failures = 0
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    res = await self.scan_all(buy_policy)
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    logger.exception(f"Pool pass failed ({failures}/{max_failures}): {e}")
+                    if failures >= max_failures:
+                        raise
+                    await asyncio.sleep(min(60.0, 2.0 ** failures))
+                    continue
+
+                if time.monotonic() - last_flush >= state_flush_sec:
+                    await self.save_state()
+                    last_flush = time.monotonic()
+
+                yield res
+
+                await asyncio.sleep(max(0.0, interval_sec + random.uniform(-jitter_sec, jitter_sec)))
+        finally:
+            await self.close(save_state=True)
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import os
+import copy
+import json
+import asyncio
+import threading
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+class SelectorCache:
+    """Запоминает, какой селектор сработал на каждом шаге навигации, и ведёт счётчики hit/miss.
+
+    hit — сохранённый селектор сработал с первой попытки, miss — пришлось гонять весь список.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = Path(path) if path else None
+        self._steps: dict[str, dict[str, Any]] = {}
+        self._dirty = False
+        self._save_lock = threading.Lock()
+        self._snapshot_seq = 0
+        self._written_seq = 0
+        if self.path and self.path.exists():
+            try:
+                self._steps = json.loads(self.path.read_text(encoding="utf-8")).get("steps", {})
+            except Exception as e:
+                logger.warning(f"Selector cache {self.path} is unreadable, starting empty: {e}")
+
+    def preferred(self, step: str, selectors: list[str]) -> str | None:
+        sel = self._steps.get(step, {}).get("selector")
+        # Список мог поменяться в коде — устаревший выбор не используем
+        return sel if sel in selectors else None
+
+    def ordered(self, step: str, selectors: list[str]) -> list[str]:
+        sel = self.preferred(step, selectors)
+        return [sel] + [s for s in selectors if s != sel] if sel else list(selectors)
+
+    def record(self, step: str, selector: str | None, hit: bool):
+        st = self._steps.setdefault(step, {"selector": None, "hits": 0, "misses": 0, "wins": {}})
+        st["hits" if hit else "misses"] += 1
+        if selector:
+            st["selector"] = selector
+            st["wins"][selector] = st["wins"].get(selector, 0) + 1
+        self._dirty = True
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {step: {"hits": st["hits"], "misses": st["misses"]} for step, st in self._steps.items()}
+
+    def save(self):
+        """Атомарная запись маленького JSON; кэш может быть общим для нескольких сканеров пула."""
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            self._write(*snapshot)
+
+    async def save_async(self):
+        """Как save(), но запись — в потоке; снимок берётся на event loop, где меняется кэш."""
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            await asyncio.to_thread(self._write, *snapshot)
+
+    def _snapshot(self) -> tuple[int, dict[str, Any]] | None:
+        if not self.path or not self._dirty:
+            return None
+        self._dirty = False
+        self._snapshot_seq += 1
+        return self._snapshot_seq, {"steps": copy.deepcopy(self._steps)}
+
+    def _write(self, seq: int, data: dict[str, Any]):
+        with self._save_lock:
+            # Сканеры пула сохраняют один кэш параллельно: старый снимок не перетирает свежий
+            if seq < self._written_seq:
+                return
+            self._written_seq = seq
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, self.path)
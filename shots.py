@@ -0,0 +1,96 @@
+from __future__ import annotations
+import time
+import asyncio
+from collections import deque
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+from loguru import logger
+from PIL import Image
+from playwright.async_api import Page
+
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from artifacts import ArtifactStore
+
+EXT = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+class Frame(NamedTuple):
+    name: str
+    taken_at: float
+    data: bytes
+    fmt: str
+
+    def as_file(self) -> BytesIO:
+        """Файлоподобный объект для отправки из памяти (Pyrogram берёт имя из .name)."""
+        f = BytesIO(self.data)
+        f.name = f"{self.name}.{EXT[self.fmt]}"
+        return f
+
+def _encode(data: bytes, fmt: str, quality: int) -> bytes:
+    out = BytesIO()
+    Image.open(BytesIO(data)).save(out, format=fmt.upper(), quality=quality)
+    return out.getvalue()
+
+class ScreenshotRing:
+    """Последние capacity кадров в памяти; на диск — только по flush (ошибка, покупка) или persist_all.
+
+    PNG/JPEG кодирует сам браузер; WebP перекодируется в отдельном потоке. Со store кадры
+    и кропы пишутся в ArtifactStore (по хешу, с лимитом размера), без него — в out_dir по имени.
+    """
+
+    def __init__(self, out_dir: str, capacity: int = 20, fmt: str = "jpeg", quality: int = 80,
+                 full_page: bool = False, persist_all: bool = False, store: ArtifactStore | None = None):
+        if fmt not in EXT:
+            raise ValueError(f"Unknown screenshot format: {fmt!r} (expected png, jpeg or webp)")
+        self.out_dir = Path(out_dir)
+        self.fmt = fmt
+        self.quality = quality
+        self.full_page = full_page
+        self.persist_all = persist_all
+        self.store = store
+        self._frames: deque[Frame] = deque(maxlen=capacity)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+    async def capture(self, page: Page, name: str, persist: bool = False) -> str:
+        """Снимает страницу в кольцо; возвращает путь, если кадр записан на диск, иначе имя кадра."""
+        with metrics.span("screenshot"):
+            if self.fmt == "jpeg":
+                data = await page.screenshot(type="jpeg", quality=self.quality, full_page=self.full_page)
+            else:
+                data = await page.screenshot(type="png", full_page=self.full_page)
+                if self.fmt == "webp":
+                    data = await asyncio.to_thread(_encode, data, "webp", self.quality)
+        return await self.add(name, data, self.fmt, persist=persist)
+
+    async def add(self, name: str, data: bytes, fmt: str = "png", persist: bool = False) -> str:
+        frame = Frame(name, time.time(), data, fmt)
+        self._frames.append(frame)
+        if persist or self.persist_all:
+            return await self.write(frame)
+        return name
+
+    def latest(self) -> Frame | None:
+        return self._frames[-1] if self._frames else None
+
+    async def write(self, frame: Frame) -> str:
+        return await self.save(frame.name, frame.data, EXT[frame.fmt], kind="screenshot")
+
+    async def save(self, name: str, data: bytes, ext: str, kind: str = "card") -> str:
+        """Пишет байты на диск (в store или out_dir) и возвращает путь."""
+        if self.store is not None:
+            path = (await self.store.put(data, kind, name=name, ext=ext)).path
+        else:
+            path = str(self.out_dir / f"{name}.{ext}")
+            await asyncio.to_thread(Path(path).write_bytes, data)
+        logger.info(f"[{kind}] {name} -> {path}")
+        return path
+
+    async def flush(self, reason: str, last: int | None = None) -> list[str]:
+        """Пишет на диск последние last кадров (по умолчанию все из кольца)."""
+        frames = list(self._frames)[-last:] if last else list(self._frames)
+        if frames:
+            logger.info(f"Flushing {len(frames)} screenshots ({reason})")
+        return [await self.write(f) for f in frames]
@@ -0,0 +1,113 @@
+import asyncio
+from types import SimpleNamespace
+
+from api_scan import ApiGiftScanner, _gift_info
+from db import GiftDB
+
+def gift(gift_id, price=100, **kw):
+    return SimpleNamespace(id=gift_id, price=price, title=f"g{gift_id}", **kw)
+
+class StubClient:
+    """Клиент с high-level API: каталог задаётся снаружи, send_gift может падать на нужных id."""
+
+    def __init__(self, catalog, fail_ids=()):
+        self.catalog = catalog
+        self.fail_ids = set(fail_ids)
+        self.sent = []
+
+    async def get_available_gifts(self):
+        return self.catalog
+
+    async def send_gift(self, chat_id, gift_id):
+        if gift_id in self.fail_ids:
+            raise RuntimeError("FLOOD_WAIT")
+        self.sent.append(gift_id)
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def open_db(tmp_path):
+    db = GiftDB(str(tmp_path / "gifts.db"))
+    await db.init()
+    return db
+
+def test_gift_info_high_level():
+    info = _gift_info(gift(7, price=250, is_limited=True, available_amount=0))
+    assert info == {"gift_id": 7, "price": 250, "limited": True, "sold_out": True, "remains": 0, "title": "g7"}
+
+def test_gift_info_raw_star_gift():
+    raw = SimpleNamespace(id=9, stars=50, limited=True, availability_remains=3, title=None)
+    info = _gift_info(raw)
+    assert (info["price"], info["limited"], info["sold_out"], info["remains"]) == (50, True, False, 3)
+
+def test_gift_info_without_price():
+    assert _gift_info(SimpleNamespace(id=1))["price"] is None
+
+def test_first_scan_seeds_catalog_without_buying(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path)
+        client = StubClient([gift(1), gift(2)])
+        res = await ApiGiftScanner(client, db).run_scan("@me", {"max_price_stars": 1000})
+        known = await db.known_gift_ids()
+        await db.close()
+        return res, known, client.sent
+    res, known, sent = run(scenario())
+    assert res["new_border_cards"] == [] and res["bought"] == []
+    assert known == {1, 2} and sent == []
+
+def test_diff_detects_only_new_gifts(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path)
+        client = StubClient([gift(1)])
+        scanner = ApiGiftScanner(client, db)
+        await scanner.run_scan("@me")
+        client.catalog = [gift(1), gift(2, is_limited=True), gift(3, is_sold_out=True)]
+        res = await scanner.run_scan("@me")
+        known = await db.known_gift_ids()
+        await db.close()
+        return res, known
+    res, known = run(scenario())
+    assert [(d["gift_id"], d["border"]) for d in res["new_border_cards"]] == [(2, True)]
+    assert known == {1, 2, 3}
+
+def test_failed_buy_is_retried_next_pass(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path)
+        client = StubClient([gift(1)])
+        scanner = ApiGiftScanner(client, db)
+        await scanner.run_scan("@me")
+        client.catalog = [gift(1), gift(2), gift(3, price=5000)]
+        client.fail_ids = {2}
+        policy = {"max_price_stars": 1000}
+        first = await scanner.run_scan("@me", policy)
+        known_after_failure = await db.known_gift_ids()
+        client.fail_ids = set()
+        second = await scanner.run_scan("@me", policy)
+        known = await db.known_gift_ids()
+        await db.close()
+        return first, known_after_failure, second, known, client.sent
+    first, known_after_failure, second, known, sent = run(scenario())
+    assert first["bought"] == []
+    # Слишком дорогой подарок отклонён окончательно, упавший — нет
+    assert known_after_failure == {1, 3}
+    assert [d["gift_id"] for d in second["bought"]] == [2] and sent == [2]
+    assert known == {1, 2, 3}
+
+def test_cap_skip_keeps_gift_eligible(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path)
+        client = StubClient([gift(1)])
+        scanner = ApiGiftScanner(client, db)
+        await scanner.run_scan("@me")
+        client.catalog = [gift(1), gift(2, price=300)]
+        res = await scanner.run_scan("@me", {"daily_cap_left": 100})
+        again = await scanner.run_scan("@me", {"daily_cap_left": 100})
+        known = await db.known_gift_ids()
+        await db.close()
+        return res, again, known, client.sent
+    res, again, known, sent = run(scenario())
+    assert res["bought"] == [] and sent == []
+    assert 2 not in known
+    # Повторная попытка не считается новинкой: handle_result не шлёт о ней сообщение снова
+    assert [d["retry"] for d in res["new_border_cards"]] == [False]
+    assert [d["retry"] for d in again["new_border_cards"]] == [True]
@@ -0,0 +1,23 @@
+import asyncio
+
+from db import DailyBudget
+
+def test_local_tokens_are_not_reused_after_commit():
+    async def scenario():
+        budget = DailyBudget(None, cap_left=1000)
+        a = await budget.reserve(100)
+        b = await budget.reserve(200)
+        await budget.commit(a)
+        c = await budget.reserve(300)
+        await budget.release(b)
+        return a, b, c, budget._left
+    a, b, c, left = asyncio.run(scenario())
+    assert len({a, b, c}) == 3
+    assert left == 600
+
+def test_local_reserve_respects_cap():
+    async def scenario():
+        budget = DailyBudget(None, cap_left=150)
+        return await budget.reserve(100), await budget.reserve(100)
+    first, second = asyncio.run(scenario())
+    assert first is not None and second is None
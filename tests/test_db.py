@@ -0,0 +1,52 @@
+import asyncio
+import sqlite3
+
+from db import GiftDB
+
+H = "ffff0000ffff0000"
+NEAR = "ffff0000ffff0001"
+
+def test_bought_is_tracked_per_recipient(tmp_path):
+    async def scenario():
+        db = GiftDB(str(tmp_path / "gifts.db"))
+        await db.init()
+        await db.add_purchase(H, "cake", 100, None, recipient="@alice")
+        live = (db.is_bought("@alice", NEAR), db.is_bought("@bob", H))
+        await db.close()
+
+        db = GiftDB(str(tmp_path / "gifts.db"))
+        await db.init()
+        await db.refresh_index()
+        reloaded = (db.is_bought("@alice", H), db.is_bought("@bob", H))
+        await db.close()
+        return live, reloaded
+    live, reloaded = asyncio.run(scenario())
+    assert live == (True, False)
+    assert reloaded == (True, False)
+
+def test_legacy_purchases_count_for_every_recipient(tmp_path):
+    path = tmp_path / "gifts.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE purchases(id INTEGER PRIMARY KEY AUTOINCREMENT, phash TEXT NOT NULL, title TEXT, "
+                     "price_stars INTEGER, bought_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, screenshot TEXT)")
+        conn.execute("INSERT INTO purchases(phash, title, price_stars) VALUES (?, 'old', 50)", (H,))
+
+    async def scenario():
+        db = GiftDB(str(path))
+        await db.init()
+        await db.refresh_index()
+        seen = db.is_bought("@alice", H), db.is_bought("@bob", NEAR)
+        await db.close()
+        return seen
+    assert asyncio.run(scenario()) == (True, True)
+
+def test_api_purchases_are_not_phash_indexed(tmp_path):
+    async def scenario():
+        db = GiftDB(str(tmp_path / "gifts.db"))
+        await db.init()
+        await db.add_purchase("gift:42", "gift 42", 10, None, recipient="@alice")
+        await db.refresh_index()
+        bought = db.is_bought("@alice", H)
+        await db.close()
+        return bought
+    assert asyncio.run(scenario()) is False
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from web_scan import CARDS_META_JS, _race_selectors, parse_price_stars
+
+# Текст карточки в том виде, в каком его отдаёт CARDS_META_JS: узлы через "\n"
+@pytest.mark.parametrize("text, price", [
+    ("⭐ 100\n1 of 10 000", 100),
+    ("2 500\n12 left", 2500),
+    ("⭐\n50", 50),
+    ("Gift\n⭐ 1 000", 1000),
+    ("⭐ 25", 25),
+    ("Sold out", None),
+])
+def test_parse_price_stars_stops_at_element_boundary(text, price):
+    assert parse_price_stars(text) == price
+
+# Мини-DOM для textOf из CARDS_META_JS: только дерево и TreeWalker по текстовым узлам
+FAKE_DOM = r"""
+const NodeFilter = {SHOW_TEXT: 4};
+const T = (v) => ({nodeValue: v});
+const E = (...children) => ({children});
+const document = {createTreeWalker(root) {
+  const nodes = [];
+  const walk = (n) => { if (n.nodeValue !== undefined) nodes.push(n); (n.children || []).forEach(walk); };
+  walk(root);
+  let i = 0;
+  return {nextNode: () => nodes[i++] || null};
+}};
+"""
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_card_text_keeps_adjacent_numeric_siblings_apart():
+    text_of = CARDS_META_JS[CARDS_META_JS.index("  const textOf"):CARDS_META_JS.index("  const g = grid")]
+    script = FAKE_DOM + text_of + r"""
+console.log(JSON.stringify([
+  textOf(E(E(T("⭐ 100")), E(T("1 of 10 000")))),
+  textOf(E(E(T("2 500")), E(T("  12  left ")), T("\n  "))),
+]));
+"""
+    out = subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True).stdout
+    texts = json.loads(out)
+    assert texts == ["⭐ 100\n1 of 10 000", "2 500\n12 left"]
+    assert [parse_price_stars(t) for t in texts] == [100, 2500]
+
+class FakePage:
+    """wait_for_selector: селектор появляется через delays[sel] секунд; None — таймаут."""
+
+    def __init__(self, delays):
+        self.delays = delays
+
+    async def wait_for_selector(self, sel, timeout):
+        delay = self.delays[sel]
+        if delay is None:
+            await asyncio.sleep(timeout / 1000)
+            raise TimeoutError(sel)
+        await asyncio.sleep(delay)
+        return f"handle:{sel}"
+
+def race(delays, grace_ms, timeout_ms=2000):
+    async def scenario():
+        t0 = time.perf_counter()
+        sel, _ = await _race_selectors(FakePage(delays), list(delays), timeout_ms, grace_ms)
+        return sel, time.perf_counter() - t0
+    return asyncio.run(scenario())
+
+def test_race_prefers_specific_selector_within_grace():
+    sel, _ = race({"specific": 0.1, "broad": 0.01}, grace_ms=400)
+    assert sel == "specific"
+
+def test_race_falls_back_to_broad_after_grace():
+    sel, elapsed = race({"specific": None, "broad": 0.01}, grace_ms=100)
+    assert sel == "broad" and elapsed < 1.0
+
+def test_race_returns_top_selector_without_waiting():
+    sel, elapsed = race({"specific": 0.01, "broad": 0.5}, grace_ms=400)
+    assert sel == "specific" and elapsed < 0.3
+
+def test_race_without_grace_takes_first_match():
+    sel, _ = race({"specific": 0.2, "broad": 0.01}, grace_ms=0)
+    assert sel == "broad"
+
+def test_race_raises_when_nothing_matches():
+    with pytest.raises(TimeoutError):
+        race({"a": None, "b": None}, grace_ms=100, timeout_ms=50)
@@ -1,6 +1,12 @@
 from __future__ import annotations
 import os
+import sys
+import time
+import builtins
+import importlib.util
+import threading
 from pathlib import Path
+from typing import Any
 from loguru import logger
 
 def ensure_dirs(*paths: str | os.PathLike):
@@ -15,3 +21,57 @@ def setup_logging(logs_dir: str):
     logger.remove()
     logger.add(Path(logs_dir) / "app.log", rotation="10 MB", retention="14 days", enqueue=True, level="INFO")
     logger.add(lambda msg: print(msg, end=""), level="INFO")
+
+class ImportTimer:
+    """Время импортов в духе python -X importtime: self/cumulative по каждому модулю.
+
+    Подменяет builtins.__import__, поэтому видит только import-выражения, выполненные
+    после install(); importlib.import_module учитывается, только если вызван внутри них.
+    """
+
+    def __init__(self):
+        self.records: list[tuple[str, int, float, float]] = []  # name, depth, self, cumulative
+        self._local = threading.local()
+        self._orig = builtins.__import__
+
+    def install(self) -> ImportTimer:
+        builtins.__import__ = self._import
+        return self
+
+    def uninstall(self):
+        builtins.__import__ = self._orig
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        full = name
+        if level:
+            try:
+                full = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__"))
+            except (ImportError, ValueError):
+                full = ""
+        if not name or not full or full in sys.modules:
+            return self._orig(name, globals, locals, fromlist, level)
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            return self._orig(name, globals, locals, fromlist, level)
+        finally:
+            cum = time.perf_counter() - t0
+            children = stack.pop()
+            if stack:
+                stack[-1] += cum
+            self.records.append((full, len(stack), cum - children, cum))
+
+    def report(self, top: int = 25) -> str:
+        lines = ["import time: self [us] | cumulative | imported package"]
+        for name, depth, self_t, cum in sorted(self.records, key=lambda r: -r[3])[:top]:
+            lines.append(f"import time: {self_t * 1e6:9.0f} | {cum * 1e6:10.0f} | {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+def startup_report(metrics: Any, timer: ImportTimer | None = None, top: int = 25) -> str:
+    """Этапы старта из metrics (startup.*) и, если был включён таймер, самые дорогие импорты."""
+    stages = metrics.run_summary()["stages"]
+    lines = [f"{name:24s} {st['max'] * 1000:8.1f} ms" for name, st in stages.items() if name.startswith("startup")]
+    if timer is not None:
+        lines += ["", timer.report(top)]
+    return "\n".join(lines)
@@ -1,14 +1,24 @@
 from __future__ import annotations
 import re
+import time
+import random
+import asyncio
 from pathlib import Path
 from io import BytesIO
-from typing import Any
+from typing import Any, AsyncIterator, Callable
 
+import numpy as np
 from loguru import logger
 from PIL import Image
-from playwright.async_api import async_playwright, Page, BrowserContext
+from playwright.async_api import async_playwright, Browser, BrowserContext, ElementHandle, Page, Playwright
 
-from detectors import phash_from_image, has_outline
+from analysis import AnalysisExecutor, CardSource
+from db import DailyBudget
+from shots import ScreenshotRing
+from selector_cache import SelectorCache
+from analysis_cache import AnalysisCache
+from browser_profile import BrowserProfile
+from metrics import metrics
 
 BURGER_SELECTORS = [
     '[aria-label="Open menu"]',
@@ -60,34 +70,200 @@ CONFIRM_SELECTORS = [
     '[data-testid="gift-send-button"]'
 ]
 
-SUCCESS_TOAST = [
-    'text=/Подарок отправлен/i',
-    'text=/Gift sent/i'
-]
+SUCCESS_TEXT = ["Подарок отправлен", "Gift sent"]
+
+# Шаги, где широкий запасной селектор ловит не то (внешний контейнер сетки, кнопку ещё
+# открывающегося диалога): точные селекторы получают фору selector_grace_ms
+PREFER_SPECIFIC_STEPS = {"gift_grid", "buy_open", "buy_confirm"}
+
+# Ставит MutationObserver до клика «подтвердить»: смотрит только на новый текст,
+# поэтому тост от прошлой покупки не засчитывается. Результат — в window.__giftConfirm.
+CONFIRM_WATCH_JS = """
+({success, insufficient, timeoutMs}) => {
+  const check = (text) => {
+    const t = (text || "").toLowerCase();
+    if (insufficient.some((m) => t.includes(m))) return "insufficient";
+    if (success.some((m) => t.includes(m))) return "success";
+    return null;
+  };
+  window.__giftConfirm = new Promise((resolve) => {
+    let timer = null;
+    const obs = new MutationObserver((mutations) => {
+      for (const m of mutations) {
+        const nodes = m.type === "characterData" ? [m.target] : m.addedNodes;
+        for (const n of nodes) {
+          const v = check(n.textContent);
+          if (v) { obs.disconnect(); clearTimeout(timer); resolve(v); return; }
+        }
+      }
+    });
+    obs.observe(document.body, {childList: true, subtree: true, characterData: true});
+    timer = setTimeout(() => {
+      obs.disconnect();
+      resolve(check(document.body.innerText) === "insufficient" ? "insufficient" : "timeout");
+    }, timeoutMs);
+  });
+}
+"""
+
+# Текст, признак бейджа, видимый прямоугольник и отпечаток каждой карточки за один round trip.
+# visible=false, если карточка обрезана вьюпортом, сеткой или прокручиваемым предком.
+# fp — 64-битный хеш размера, тегов, атрибутов (style, class, src) и текста карточки:
+# пока он не меняется, пиксели карточки считаются прежними.
+CARDS_META_JS = """
+({grid, cards}) => {
+  const rectOf = (r) => ({x: r.x, y: r.y, width: r.width, height: r.height});
+  const hash = (s) => {
+    let h1 = 0xdeadbeef, h2 = 0x41c6ce57;
+    for (let i = 0; i < s.length; i++) {
+      const c = s.charCodeAt(i);
+      h1 = Math.imul(h1 ^ c, 2654435761);
+      h2 = Math.imul(h2 ^ c, 1597334677);
+    }
+    h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+    h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+    return (h2 >>> 0).toString(16).padStart(8, "0") + (h1 >>> 0).toString(16).padStart(8, "0");
+  };
+  const fingerprint = (el, r) => {
+    const parts = [Math.round(r.width), Math.round(r.height)];
+    for (const n of [el, ...el.querySelectorAll("*")]) {
+      parts.push(n.tagName);
+      for (const a of n.attributes) parts.push(a.name + "=" + a.value);
+      if (n.currentSrc) parts.push(n.currentSrc);
+    }
+    parts.push(el.textContent || "");
+    return hash(parts.join("\\u0001"));
+  };
+  // Текст по узлам через "\\n": textContent склеивает соседние элементы ("⭐ 100" + "1 of 10" -> "⭐ 1001 of 10")
+  const textOf = (el) => {
+    const out = [];
+    const walker = document.createTreeWalker(el, NodeFilter.SHOW_TEXT);
+    for (let n = walker.nextNode(); n; n = walker.nextNode()) {
+      const t = n.nodeValue.replace(/\\s+/g, " ").trim();
+      if (t) out.push(t);
+    }
+    return out.join("\\n");
+  };
+  const g = grid.getBoundingClientRect();
+  return {
+    grid: rectOf(g),
+    cards: cards.map((el) => {
+      const r = el.getBoundingClientRect();
+      let clip = {left: 0, top: 0, right: window.innerWidth, bottom: window.innerHeight};
+      for (let p = el.parentElement; p; p = p.parentElement) {
+        const ov = getComputedStyle(p).overflow;
+        if (ov === "visible") continue;
+        const pr = p.getBoundingClientRect();
+        clip = {left: Math.max(clip.left, pr.left), top: Math.max(clip.top, pr.top),
+                right: Math.min(clip.right, pr.right), bottom: Math.min(clip.bottom, pr.bottom)};
+      }
+      const inside = (a, b) => a.left >= b.left - 0.5 && a.top >= b.top - 0.5
+                            && a.right <= b.right + 0.5 && a.bottom <= b.bottom + 0.5;
+      return {
+        text: textOf(el),
+        dom_new: /(new|badge|outline|highlight|premium)/i.test(el.innerHTML),
+        rect: rectOf(r),
+        visible: r.width > 0 && r.height > 0 && inside(r, clip) && inside(r, g),
+        fp: fingerprint(el, r),
+      };
+    }),
+  };
+}
+"""
+
+def _card_boxes(grid_shape: tuple[int, ...], meta: dict[str, Any]) -> list[tuple[int, int, int, int] | None]:
+    """Пиксельные прямоугольники (x0, y0, x1, y1) карточек внутри скриншота сетки.
+
+    None — для карточек, чей прямоугольник ненадёжен: их нужно снимать по отдельности.
+    """
+    cards = meta["cards"]
+    g = meta["grid"]
+    gh, gw = grid_shape[:2]
+    if g["width"] <= 0 or g["height"] <= 0:
+        return [None] * len(cards)
+    scale = gw / g["width"]
+    if abs(gh - g["height"] * scale) > 2:
+        # Скриншот не совпадает с геометрией сетки (скролл/ресайз между вызовами)
+        return [None] * len(cards)
+
+    boxes: list[tuple[int, int, int, int] | None] = []
+    for c in cards:
+        r = c["rect"]
+        x0 = round((r["x"] - g["x"]) * scale)
+        y0 = round((r["y"] - g["y"]) * scale)
+        x1 = round((r["x"] + r["width"] - g["x"]) * scale)
+        y1 = round((r["y"] + r["height"] - g["y"]) * scale)
+        if not c["visible"] or x0 < 0 or y0 < 0 or x1 > gw or y1 > gh or x1 <= x0 or y1 <= y0:
+            boxes.append(None)
+        else:
+            boxes.append((x0, y0, x1, y1))
+    return boxes
+
+def _png_bytes(arr: np.ndarray) -> bytes:
+    out = BytesIO()
+    Image.fromarray(arr).save(out, format="PNG")
+    return out.getvalue()
 
 def parse_price_stars(dom_html: str) -> int | None:
-    m = re.search(r'[\u2B50⭐]\s*([\d\s]+)', dom_html)
+    """Цена в звёздах из текста карточки: пробел внутри числа — разделитель разрядов, перевод строки — граница элемента."""
+    m = re.search(r'[\u2B50⭐]\s*(\d[\d \u00a0]*)', dom_html)
     if not m:
-        nums = re.findall(r'(\d[\d\s]{2,})', dom_html)
+        nums = re.findall(r'(\d[\d \u00a0]{2,})', dom_html)
         if not nums:
             return None
         value = max(nums, key=lambda s: len(s))
-        return int(value.replace(" ", ""))
-    return int(m.group(1).replace(" ", ""))
-
-async def _click_any(page: Page, selectors: list[str], timeout_ms: int) -> bool:
-    for sel in selectors:
-        try:
-            await page.wait_for_selector(sel, timeout=timeout_ms)
-            await page.click(sel)
-            logger.info(f"Clicked: {sel}")
-            return True
-        except Exception:
-            continue
-    return False
+        return int(re.sub(r"\D", "", value))
+    return int(re.sub(r"\D", "", m.group(1)))
+
+async def _race_selectors(page: Page, selectors: list[str], timeout_ms: int,
+                          grace_ms: int = 0) -> tuple[str, ElementHandle]:
+    """Ждёт все селекторы одновременно; побеждает первый появившийся (при ничьей — раньше в списке).
+
+    С grace_ms совпадение селектора из конца списка ждёт ещё до grace_ms более ранние:
+    широкие запасные селекторы не должны выигрывать у точных на случайном тайминге.
+    """
+    rank = {sel: n for n, sel in enumerate(selectors)}
+    tasks = {asyncio.create_task(page.wait_for_selector(sel, timeout=timeout_ms)): sel for sel in selectors}
+    pending = set(tasks)
+    last_error: BaseException | None = None
+    best: tuple[int, str, ElementHandle] | None = None
+    loop = asyncio.get_running_loop()
+    deadline: float | None = None
+    try:
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None and t.result() is not None:
+                    if best is None or rank[tasks[t]] < best[0]:
+                        best = (rank[tasks[t]], tasks[t], t.result())
+                else:
+                    last_error = t.exception() or last_error
+            if best is None:
+                continue
+            if all(rank[tasks[t]] > best[0] for t in pending):
+                break
+            if deadline is None:
+                deadline = loop.time() + grace_ms / 1000
+            if loop.time() >= deadline:
+                break
+    finally:
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    if best is not None:
+        return best[1], best[2]
+    raise last_error or TimeoutError(f"None of {selectors} appeared")
+
+async def launch_browser(pw: Playwright, headless: bool, profile: BrowserProfile | None = None) -> Browser:
+    return await pw.chromium.launch(headless=headless, args=(profile or BrowserProfile()).launch_args)
 
 class WebGiftScanner:
-    def __init__(self, url: str, state_file: str, screenshots_dir: str, headless: bool, timeout_sec: int, screenshot_every_step: bool):
+    def __init__(self, url: str, state_file: str, screenshots_dir: str, headless: bool, timeout_sec: int, screenshot_every_step: bool,
+                 scan_cfg: dict[str, Any] | None = None, analysis: AnalysisExecutor | None = None,
+                 shots: ScreenshotRing | None = None, selector_cache: SelectorCache | None = None,
+                 analysis_cache: AnalysisCache | None = None, profile: BrowserProfile | None = None):
         self.url = url
         self.state_file = state_file
         self.screenshots_dir = screenshots_dir
@@ -95,177 +271,559 @@ class WebGiftScanner:
         self.timeout = timeout_sec * 1000
         self.screenshot_every_step = screenshot_every_step
         Path(screenshots_dir).mkdir(parents=True, exist_ok=True)
-
-    async def _screenshot(self, page: Page, name: str):
-        path = Path(self.screenshots_dir) / f"{name}.png"
-        await page.screenshot(path=str(path), full_page=True)
-        logger.info(f"[screenshot] {path}")
-        return str(path)
+        self.shots = shots or ScreenshotRing(screenshots_dir)
+        self.selector_cache = selector_cache or SelectorCache()
+        self.profile = profile or BrowserProfile()
+        self.cached_selector_timeout_ms = 2000
+
+        scan_cfg = scan_cfg or {}
+        self.min_card_w = int(scan_cfg.get("min_card_w", 120))
+        self.min_card_h = int(scan_cfg.get("min_card_h", 120))
+        self.picker_max_age_sec = float(scan_cfg.get("picker_max_age_sec", 30))
+        self.selector_grace_ms = int(scan_cfg.get("selector_grace_ms", 400))
+        self.max_cards_in_flight = max(1, int(scan_cfg.get("max_cards_in_flight", 16)))
+        self.pipeline_chunk = max(1, int(scan_cfg.get("pipeline_chunk", 4)))
+        self.analysis = analysis or AnalysisExecutor(
+            "sync",
+            edge_band_px=int(scan_cfg.get("edge_band_px", 14)),
+            edge_density_threshold=float(scan_cfg.get("edge_density_threshold", 0.08)),
+        )
+        self.analysis_cache = analysis_cache or AnalysisCache(params=self.analysis.params)
+
+        self._pw: Playwright | None = None
+        self._browser: Browser | None = None
+        self._owns_browser = True
+        self._context: BrowserContext | None = None
+        self._page: Page | None = None
+        self._page_crashed = False
+        self._picker: tuple[str, str, float] | None = None
+
+    async def _screenshot(self, page: Page, name: str, persist: bool = False) -> str:
+        return await self.shots.capture(page, name, persist=persist)
+
+    async def _find(self, page: Page, step: str, selectors: list[str]) -> ElementHandle:
+        """Сначала пробует запомненный для шага селектор, при промахе гоняет весь список параллельно."""
+        cached = self.selector_cache.preferred(step, selectors)
+        if cached:
+            try:
+                handle = await page.wait_for_selector(cached, timeout=min(self.timeout, self.cached_selector_timeout_ms))
+                if handle is not None:
+                    self.selector_cache.record(step, cached, hit=True)
+                    metrics.inc("selector_cache_hits")
+                    return handle
+            except Exception:
+                pass
+            metrics.inc("selector_fallbacks")
+        try:
+            grace = self.selector_grace_ms if step in PREFER_SPECIFIC_STEPS else 0
+            sel, handle = await _race_selectors(page, selectors, self.timeout, grace)
+        except BaseException:
+            self.selector_cache.record(step, None, hit=False)
+            raise
+        self.selector_cache.record(step, sel, hit=False)
+        logger.info(f"Step '{step}' matched selector: {sel}")
+        return handle
 
     async def _click_first_available(self, page: Page, selectors: list[str], name: str):
-        last_error = None
-        for sel in selectors:
-            try:
-                await page.wait_for_selector(sel, timeout=self.timeout)
-                await page.click(sel)
-                logger.info(f"Clicked '{name}' via selector: {sel}")
-                return True
-            except Exception as e:
-                last_error = e
-        if last_error:
-            raise last_error
-        return False
+        with metrics.span(f"click.{name}"):
+            handle = await self._find(page, name, selectors)
+            await handle.click()
+        logger.info(f"Clicked '{name}'")
+        return True
+
+    async def _click_any(self, page: Page, selectors: list[str], name: str) -> bool:
+        try:
+            return await self._click_first_available(page, selectors, name)
+        except Exception:
+            return False
 
     async def _type_and_select_contact(self, page: Page, username: str):
-        for sel in SEARCH_INPUT_SELECTORS:
+        try:
+            inp = await self._find(page, "search_input", SEARCH_INPUT_SELECTORS)
+        except Exception as e:
+            raise RuntimeError("Search input not found") from e
+        await inp.fill(username)
+        await page.wait_for_timeout(600)
+        await page.keyboard.press("Enter")
+        logger.info(f"Selected contact {username}")
+
+    # === Жизненный цикл браузера ===
+
+    async def start(self, browser: Browser | None = None):
+        """Запускает Chromium, контекст из state_file и одну рабочую вкладку.
+
+        С browser — работает в общем (чужом) процессе Chromium и закрывает только свой контекст.
+        """
+        if browser is not None and browser is not self._browser:
+            self._browser, self._owns_browser, self._context = browser, False, None
+        if not self._owns_browser:
+            if self._browser is None or not self._browser.is_connected():
+                raise RuntimeError("Shared browser is not connected")
+        else:
+            if self._pw is None:
+                self._pw = await async_playwright().start()
+            if self._browser is None or not self._browser.is_connected():
+                with metrics.span("launch"):
+                    self._browser = await launch_browser(self._pw, self.headless, self.profile)
+                self._context = None
+        if self._context is None:
+            state_path = Path(self.state_file)
+            storage_state = str(state_path) if state_path.exists() else None
+            with metrics.span("new_context"):
+                self._context = await self._browser.new_context(storage_state=storage_state, viewport={"width":1280, "height":800},
+                                                                **self.profile.context_options())
+                await self.profile.apply(self._context)
+            self._page = None
+        if self._page is None or self._page.is_closed():
+            self._page = await self._context.new_page()
+            self._page_crashed = False
+            self._page.on("crash", self._on_page_crash)
+
+    def _on_page_crash(self, _page: Page):
+        logger.error("Telegram Web page crashed")
+        self._page_crashed = True
+
+    async def save_state(self):
+        if self._context is None:
+            return
+        await self._context.storage_state(path=str(Path(self.state_file)))
+        logger.info(f"Storage state saved to {self.state_file}")
+
+    async def reconnect(self):
+        """Пересоздаёт вкладку и контекст (и браузер, если он отвалился)."""
+        logger.warning("Reconnecting browser session")
+        for closer in (self._page, self._context):
+            if closer is None:
+                continue
             try:
-                inp = await page.wait_for_selector(sel, timeout=self.timeout)
-                await inp.fill(username)
-                await page.wait_for_timeout(600)
-                await page.keyboard.press("Enter")
-                logger.info(f"Selected contact {username}")
-                return
+                await closer.close()
+            except Exception:
+                pass
+        self._page = None
+        self._context = None
+        self._picker = None
+        await self.start()
+
+    async def close(self, save_state: bool = True):
+        logger.info(f"Selector cache stats: {self.selector_cache.stats()}")
+        try:
+            if save_state and self._context is not None:
+                await self.save_state()
+        except Exception as e:
+            logger.warning(f"Could not save storage state: {e}")
+        finally:
+            if self._context is not None:
+                await self._context.close()
+            if self._owns_browser:
+                if self._browser is not None:
+                    await self._browser.close()
+                if self._pw is not None:
+                    await self._pw.stop()
+                self._pw = self._browser = None
+            self._context = self._page = None
+
+    def _session_expired(self, page: Page) -> bool:
+        return any(k in page.url for k in ("login", "auth", "qr"))
+
+    # === Сканирование ===
+
+    async def _open_gift_picker(self, page: Page, recipient_username: str, result: dict[str, Any]):
+        with metrics.span("goto"):
+            # Дальше всё равно ждём конкретные элементы, так что networkidle не нужен
+            await page.goto(self.url, wait_until=self.profile.wait_until, timeout=self.timeout)
+        if self.screenshot_every_step:
+            result["screens"].append(await self._screenshot(page, "step_1_open_web"))
+
+        if self._session_expired(page):
+            logger.warning("Not authenticated in Telegram Web. Please login once; state will be saved.")
+            await page.wait_for_timeout(120_000)
+
+        await self._click_first_available(page, BURGER_SELECTORS, "burger")
+        if self.screenshot_every_step:
+            result["screens"].append(await self._screenshot(page, "step_2_burger_open"))
+
+        await self._click_first_available(page, PROFILE_SELECTORS, "profile")
+        if self.screenshot_every_step:
+            result["screens"].append(await self._screenshot(page, "step_3_profile_open"))
+
+        await self._click_first_available(page, SEND_GIFT_SELECTORS, "send_gift")
+        if self.screenshot_every_step:
+            result["screens"].append(await self._screenshot(page, "step_4_send_gift"))
+
+        with metrics.span("contact_select"):
+            await self._type_and_select_contact(page, recipient_username)
+        if self.screenshot_every_step:
+            result["screens"].append(await self._screenshot(page, "step_5_contact_selected"))
+
+    async def _scan_grid(self, page: Page, recipient_username: str, buy_policy: dict[str, Any] | None,
+                         result: dict[str, Any]):
+        try:
+            with metrics.span("grid_find"):
+                grid = await self._find(page, "gift_grid", GIFTS_GRID_SELECTORS)
+        except Exception as e:
+            raise RuntimeError("Gift grid not found") from e
+
+        t_extract = time.perf_counter()
+        cards = []
+        for n, csel in enumerate(self.selector_cache.ordered("gift_card", CARD_SELECTORS)):
+            try:
+                cards = await grid.query_selector_all(csel)
+                if cards:
+                    self.selector_cache.record("gift_card", csel, hit=n == 0)
+                    break
             except Exception:
                 continue
-        raise RuntimeError("Search input not found")
-
-    async def run_scan(self, recipient_username: str, buy_policy: dict[str, Any] | None = None) -> dict:
-        result: dict[str, Any] = {"new_border_cards": [], "screens": [], "bought": []}
-
-        async with async_playwright() as pw:
-            state_path = Path(self.state_file)
-            storage_state = str(state_path) if state_path.exists() else None
-
-            browser = await pw.chromium.launch(headless=self.headless, args=["--disable-dev-shm-usage", "--no-sandbox"])
-            context: BrowserContext = await browser.new_context(storage_state=storage_state, viewport={"width":1280, "height":800})
-            page: Page = await context.new_page()
-
+        if not cards:
+            logger.warning("No gift cards found by selectors")
+            metrics.inc("scans_without_cards")
+            return
+        metrics.inc("cards_scanned", len(cards))
+
+        # Один evaluate на все карточки вместо inner_html() на каждую
+        meta = await page.evaluate(CARDS_META_JS, {"grid": grid, "cards": cards})
+        metrics.observe("card_extract", time.perf_counter() - t_extract)
+
+        # Карточки с известным отпечатком берут результат из кэша: ни скриншота, ни хеширования
+        analysed: dict[int, dict[str, Any]] = {}
+        for i, info in enumerate(meta["cards"]):
+            entry = self.analysis_cache.get(info["fp"])
+            if entry is not None:
+                analysed[i] = entry
+        misses = [i for i in range(len(cards)) if i not in analysed]
+        metrics.inc("analysis_cache_hits", len(analysed))
+        metrics.inc("analysis_cache_misses", len(misses))
+
+        grid_png = None
+        if misses:
+            logger.info(f"Analysing {len(misses)}/{len(cards)} new or changed cards")
+            # Кадр сетки снимаем до первой покупки: диалог покупки перекроет карточки
+            with metrics.span("grid_capture"):
+                grid_png = await grid.screenshot()
+                result["screens"].append(await self.shots.add("step_6_gift_grid", grid_png, "png"))
+
+        # Конвейер: захват -> анализ -> покупка. Каждая подходящая карточка сразу уходит
+        # в покупку, не дожидаясь остальной сетки; покупка ждёт только освобождения страницы.
+        t_pipeline = time.perf_counter()
+        detected: list[dict[str, Any]] = []
+        bought: list[dict[str, Any]] = []
+        buy_q: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+        page_free = asyncio.Event()
+
+        def qualify(i: int, entry: dict[str, Any]):
+            info = meta["cards"][i]
+            dom_flag = bool(info["dom_new"])
+            # Мелкие элементы — не карточки, их бейдж не в счёт (phash у подходящей карточки есть всегда)
+            if not entry.get("card", True) or entry["phash"] is None or not (dom_flag or entry["border"]):
+                return
+            d = {"idx": i + 1, "phash": entry["phash"], "path": entry.get("path"), "recipient": recipient_username,
+                 "dom_new": dom_flag, "border": entry["border"],
+                 "price": entry["price"], "title": info["text"].replace("\n", " ")[:120]}
+            if not detected:
+                metrics.observe("scan.first_detection", time.perf_counter() - t_pipeline)
+            detected.append(d)
+            if buy_policy:
+                buy_q.put_nowait(d)
+
+        async def buyer():
+            await page_free.wait()
+            while (d := await buy_q.get()) is not None:
+                if await self._try_buy(page, cards[d["idx"]-1], d, buy_policy, result):
+                    if not bought:
+                        metrics.observe("scan.first_buy", time.perf_counter() - t_pipeline)
+                    bought.append(d)
+
+        for i in sorted(analysed):
+            qualify(i, analysed[i])
+        buy_task = asyncio.create_task(buyer()) if buy_policy else None
+        try:
+            if misses:
+                await self._analyse_stream(cards, meta, grid_png, misses, page_free, qualify)
+        finally:
+            page_free.set()
             try:
-                await page.goto(self.url, wait_until="networkidle", timeout=self.timeout)
-                if self.screenshot_every_step:
-                    result["screens"].append(await self._screenshot(page, "step_1_open_web"))
-
-                if any(k in page.url for k in ("login", "auth", "qr")):
-                    logger.warning("Not authenticated in Telegram Web. Please login once; state will be saved.")
-                    await page.wait_for_timeout(120_000)
-
-                await self._click_first_available(page, BURGER_SELECTORS, "burger")
-                if self.screenshot_every_step:
-                    result["screens"].append(await self._screenshot(page, "step_2_burger_open"))
-
-                await self._click_first_available(page, PROFILE_SELECTORS, "profile")
-                if self.screenshot_every_step:
-                    result["screens"].append(await self._screenshot(page, "step_3_profile_open"))
-
-                await self._click_first_available(page, SEND_GIFT_SELECTORS, "send_gift")
-                if self.screenshot_every_step:
-                    result["screens"].append(await self._screenshot(page, "step_4_send_gift"))
-
-                await self._type_and_select_contact(page, recipient_username)
-                if self.screenshot_every_step:
-                    result["screens"].append(await self._screenshot(page, "step_5_contact_selected"))
-
-                grid = None
-                for sel in GIFTS_GRID_SELECTORS:
-                    try:
-                        grid = await page.wait_for_selector(sel, timeout=self.timeout)
-                        break
-                    except Exception:
-                        continue
-                if grid is None:
-                    raise RuntimeError("Gift grid not found")
-
-                grid_shot_path = Path(self.screenshots_dir) / "step_6_gift_grid.png"
-                await grid.screenshot(path=str(grid_shot_path))
-                result["screens"].append(str(grid_shot_path))
-
-                cards = []
-                for csel in CARD_SELECTORS:
-                    try:
-                        cards = await grid.query_selector_all(csel)
-                        if cards:
-                            break
-                    except Exception:
-                        continue
-                if not cards:
-                    logger.warning("No gift cards found by selectors")
-                    return result
-
-                detected = []
-                for idx, card in enumerate(cards, start=1):
-                    dom_html = await card.inner_html()
-                    price = parse_price_stars(dom_html)
-                    card_png = await card.screenshot()
-                    img = Image.open(BytesIO(card_png))
-
-                    if img.width < 120 or img.height < 120:
-                        continue
-
-                    border_flag = has_outline(img)
-                    dom_flag = bool(re.search(r"(new|badge|outline|highlight|premium)", dom_html, re.I))
-
-                    if dom_flag or border_flag:
-                        h = phash_from_image(img)
-                        card_path = Path(self.screenshots_dir) / f"gift_card_{idx}_{h}.png"
-                        img.save(card_path)
-                        title = re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", dom_html)).strip()[:120]
-                        detected.append({"idx": idx, "phash": h, "path": str(card_path),
-                                         "dom_new": dom_flag, "border": border_flag,
-                                         "price": price, "title": title})
-
+                if buy_task is not None:
+                    buy_q.put_nowait(None)
+                    await buy_task
+            finally:
+                # Даже при ошибке конвейера уже совершённые покупки должны дойти до handle_result
+                detected.sort(key=lambda d: d["idx"])
                 result["new_border_cards"] = detected
-
-                # === Покупка ===
+                metrics.inc("detections", len(detected))
                 if buy_policy and detected:
-                    bought = []
-                    cap = int(buy_policy.get("daily_cap_left", 10**9))
-                    max_price = int(buy_policy.get("max_price_stars", 10**9))
-                    wait_ms = int(buy_policy.get("wait_success_ms", 6000))
-                    insufficient = [s.lower() for s in buy_policy.get("insufficient_text", [])]
-
-                    for d in detected:
-                        price = d.get("price") or 0
-                        if price <= 0 or price > max_price or price > cap:
-                            continue
-                        try:
-                            await cards[d["idx"]-1].click()
-                            result["screens"].append(await self._screenshot(page, f"buy_{d['idx']}_opened"))
-
-                            await _click_any(page, BUY_OPEN_SELECTORS, self.timeout)
-                            await _click_any(page, CONFIRM_SELECTORS, self.timeout)
-
-                            await page.wait_for_timeout(wait_ms)
-
-                            toast_ok = False
-                            for sel in SUCCESS_TOAST:
-                                try:
-                                    await page.wait_for_selector(sel, timeout=1000)
-                                    toast_ok = True
-                                    break
-                                except Exception:
-                                    continue
-
-                            page_html = (await page.content()).lower()
-                            if any(t in page_html for t in insufficient):
-                                result["screens"].append(await self._screenshot(page, f"buy_{d['idx']}_insufficient"))
-                                continue
-
-                            shot = await self._screenshot(page, f"buy_{d['idx']}_done" if toast_ok else f"buy_{d['idx']}_maybe")
-                            d["bought"] = bool(toast_ok)
-                            d["buy_screen"] = shot
-                            if toast_ok:
-                                cap -= price
-                                bought.append(d)
-                        except Exception as e:
-                            logger.exception(f"Buy flow failed for idx={d['idx']}: {e}")
-                            result["screens"].append(await self._screenshot(page, f"buy_{d['idx']}_error"))
-
                     result["bought"] = bought
 
-                await context.storage_state(path=str(state_path))
+    async def _analyse_stream(self, cards: list[ElementHandle], meta: dict[str, Any], grid_png: bytes,
+                              indices: list[int], page_free: asyncio.Event,
+                              on_entry: Callable[[int, dict[str, Any]], None]):
+        """phash и обводка для карточек indices потоком: результат каждой карточки — сразу в on_entry и в кэш.
+
+        Продюсер режет карточки из кадра сетки или снимает их по отдельности, пока воркеры
+        анализируют уже снятые; в очереди не больше max_cards_in_flight карточек. page_free
+        ставится после последнего отдельного снимка: дальше страница нужна только покупке.
+        """
+        grid_arr = np.asarray(Image.open(BytesIO(grid_png)).convert("RGB"))
+        boxes = _card_boxes(grid_arr.shape, meta)
+        fallbacks = [i for i in indices if boxes[i] is None]
+        if not fallbacks:
+            page_free.set()
+        else:
+            logger.info(f"Per-card capture for {len(fallbacks)}/{len(indices)} cards with unreliable bounding boxes")
+            metrics.inc("card_capture_fallbacks", len(fallbacks))
+
+        n_workers = 1 if self.analysis.kind == "sync" else self.analysis.workers
+        queue: asyncio.Queue[tuple[int, CardSource, bytes | None] | None] = asyncio.Queue(maxsize=self.max_cards_in_flight)
+
+        def finish(i: int, entry: dict[str, Any]):
+            self.analysis_cache.put(meta["cards"][i]["fp"], entry)
+            on_entry(i, entry)
+
+        async def produce():
+            for i in indices:
+                box = boxes[i]
+                if box is None:
+                    try:
+                        png = await cards[i].screenshot()
+                    except Exception as e:
+                        # Карточка пропала из DOM (перерисовка сетки): без кэша её разберёт следующий проход
+                        logger.warning(f"Card {i + 1} capture failed, skipping: {e}")
+                        metrics.inc("card_capture_errors")
+                        continue
+                    finally:
+                        if i == fallbacks[-1]:
+                            page_free.set()
+                    w, h = Image.open(BytesIO(png)).size
+                else:
+                    png = None
+                    w, h = box[2] - box[0], box[3] - box[1]
+                if w < self.min_card_w or h < self.min_card_h:
+                    # Мелкие элементы (не карточки) тоже кэшируем, чтобы не снимать их каждый проход
+                    finish(i, {"card": False, "phash": None, "border": False, "price": parse_price_stars(meta["cards"][i]["text"])})
+                    continue
+                if box is None:
+                    src = png
+                else:
+                    x0, y0, x1, y1 = box
+                    src = frame.crop(box) if frame is not None else grid_arr[y0:y1, x0:x1]
+                await queue.put((i, src, png))
+            for _ in range(n_workers):
+                await queue.put(None)
+
+        async def consume():
+            done = False
+            while not done:
+                item = await queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                while len(batch) < self.pipeline_chunk and not queue.empty():
+                    nxt = queue.get_nowait()
+                    if nxt is None:
+                        done = True
+                        break
+                    batch.append(nxt)
+                try:
+                    with metrics.span("detect"):
+                        results = await self.analysis.analyze_many([(src, bool(meta["cards"][i]["dom_new"])) for i, src, _ in batch])
+                except Exception as e:
+                    logger.warning(f"Analysis of cards {[i + 1 for i, _, _ in batch]} failed, skipping: {e}")
+                    metrics.inc("card_analysis_errors", len(batch))
+                    continue
+                for (i, _, png), (h, border_flag) in zip(batch, results):
+                    info = meta["cards"][i]
+                    entry = {"phash": h, "border": border_flag, "price": parse_price_stars(info["text"])}
+                    if info["dom_new"] or border_flag:
+                        if png is None:
+                            x0, y0, x1, y1 = boxes[i]
+                            png = await asyncio.to_thread(_png_bytes, grid_arr[y0:y1, x0:x1])
+                        # Одинаковый кроп (та же карточка на другом месте сетки) ляжет в store один раз
+                        entry["path"] = await self.shots.save(f"gift_card_{i + 1}_{h}", png, "png", kind="card")
+                    finish(i, entry)
+
+        frame = self.analysis.share(grid_arr)
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(consume()) for _ in range(n_workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            if frame is not None:
+                frame.close()
+
+    async def _try_buy(self, page: Page, card: ElementHandle, d: dict[str, Any],
+                       buy_policy: dict[str, Any], result: dict[str, Any]) -> bool:
+        """Покупка одной карточки под резервом дневного бюджета; True, если подтверждена тостом."""
+        budget: DailyBudget = buy_policy.get("budget") or DailyBudget(None, cap_left=buy_policy.get("daily_cap_left"))
+        buy_policy["budget"] = budget
+        max_price = int(buy_policy.get("max_price_stars", 10**9))
+        wait_ms = int(buy_policy.get("wait_success_ms", 6000))
+        success = [s.lower() for s in buy_policy.get("success_text", SUCCESS_TEXT)]
+        insufficient = [s.lower() for s in buy_policy.get("insufficient_text", [])]
+        is_bought = buy_policy.get("is_bought")
+
+        price = d.get("price") or 0
+        if price <= 0 or price > max_price:
+            return False
+        if d.get("phash") is None:
+            logger.warning(f"Skip buying idx={d['idx']}: no phash, the element is not a gift card")
+            return False
+        if is_bought is not None and is_bought(d["recipient"], d["phash"]):
+            logger.info(f"Skip buying idx={d['idx']}: {d['recipient']} already got a gift near phash {d['phash']}")
+            return False
+        reservation = await budget.reserve(price)
+        if reservation is None:
+            logger.info(f"Skip buying idx={d['idx']}: daily cap would be exceeded by {price}⭐")
+            return False
+
+        toast_ok = False
+        metrics.inc("buy_attempts")
+        t_buy = time.perf_counter()
+        try:
+            # Диалог покупки уводит со страницы выбора: следующий проход откроет её заново
+            self._picker = None
+            with metrics.span("buy.open_card"):
+                await card.click()
+            result["screens"].append(await self._screenshot(page, f"buy_{d['idx']}_opened"))
+
+            await self._click_any(page, BUY_OPEN_SELECTORS, "buy_open")
+            await page.evaluate(CONFIRM_WATCH_JS, {"success": success, "insufficient": insufficient, "timeoutMs": wait_ms})
+            await self._click_any(page, CONFIRM_SELECTORS, "buy_confirm")
+
+            # Ждём тост или «недостаточно» ровно столько, сколько он появляется; wait_ms — только верхняя граница
+            with metrics.span("buy.wait_confirmation"):
+                outcome = await page.evaluate("() => window.__giftConfirm")
+            toast_ok = outcome == "success"
+            metrics.inc(f"buy_outcome.{outcome}")
+            logger.info(f"Buy idx={d['idx']} confirmation: {outcome}")
+
+            if outcome == "insufficient":
+                result["screens"].append(await self._screenshot(page, f"buy_{d['idx']}_insufficient"))
+                result["screens"].extend(await self.shots.flush(f"insufficient funds idx={d['idx']}", last=3))
+                return False
+
+            # Кадр покупки нужен на диске: путь уходит в purchases и в уведомление
+            shot = await self._screenshot(page, f"buy_{d['idx']}_done" if toast_ok else f"buy_{d['idx']}_maybe", persist=True)
+            d["bought"] = bool(toast_ok)
+            d["buy_screen"] = shot
+            return toast_ok
+        except Exception as e:
+            metrics.inc("buy_failures")
+            logger.exception(f"Buy flow failed for idx={d['idx']}: {e}")
+            result["screens"].append(await self._screenshot(page, f"buy_{d['idx']}_error"))
+            result["screens"].extend(await self.shots.flush(f"buy error idx={d['idx']}", last=3))
+            return False
+        finally:
+            metrics.observe("buy.total", time.perf_counter() - t_buy)
+            if toast_ok:
+                await budget.commit(reservation)
+            else:
+                await budget.release(reservation)
+
+    async def _picker_alive(self, page: Page, recipient_username: str) -> bool:
+        """Открыт ли ещё выбор подарка для этого получателя: тот же URL и сетка на месте в DOM."""
+        if self._picker is None:
+            return False
+        recipient, url, opened_at = self._picker
+        if recipient != recipient_username or page.url != url:
+            return False
+        if time.monotonic() - opened_at > self.picker_max_age_sec:
+            # Каталог в открытом окне может не обновляться сам: переиспользованный выбор отстаёт
+            # от сервера не больше чем на picker_max_age_sec, дальше открываем заново
+            return False
+        for sel in self.selector_cache.ordered("gift_grid", GIFTS_GRID_SELECTORS):
+            try:
+                grid = await page.query_selector(sel)
+                if grid is not None and await grid.is_visible():
+                    return True
+            except Exception:
+                continue
+        return False
 
-            finally:
-                await context.close()
-                await browser.close()
+    async def scan_once(self, recipient_username: str, buy_policy: dict[str, Any] | None = None) -> dict:
+        """Один проход по уже запущенному браузеру: открыть выбор подарка, просканировать сетку, купить."""
+        result: dict[str, Any] = {"new_border_cards": [], "screens": [], "bought": []}
+        if self._page is None or self._page.is_closed() or self._page_crashed:
+            await self.reconnect()
+        page = self._page
 
+        t_scan = time.perf_counter()
+        try:
+            if await self._picker_alive(page, recipient_username):
+                logger.info(f"Gift picker for {recipient_username} still open, re-scanning in place")
+                metrics.inc("picker_reused")
+            else:
+                self._picker = None
+                await self._open_gift_picker(page, recipient_username, result)
+                self._picker = (recipient_username, page.url, time.monotonic())
+            await self._scan_grid(page, recipient_username, buy_policy, result)
+        except Exception as e:
+            self._picker = None
+            try:
+                await self._screenshot(page, "scan_error")
+            except Exception:
+                pass
+            await self.shots.flush("scan error")
+            metrics.inc("scan_failures")
+            if not result["bought"]:
+                raise
+            # Деньги уже списаны: возвращаем частичный результат, чтобы покупки записались и не повторились
+            logger.exception(f"Scan failed after {len(result['bought'])} purchases, reporting them: {e}")
+            result["scan_error"] = str(e)
+        finally:
+            metrics.observe("scan", time.perf_counter() - t_scan)
+            await asyncio.gather(self.selector_cache.save_async(), self.analysis_cache.save_async())
         return result
+
+    async def run_scan(self, recipient_username: str, buy_policy: dict[str, Any] | None = None) -> dict:
+        await self.start()
+        try:
+            return await self.scan_once(recipient_username, buy_policy)
+        finally:
+            await self.close(save_state=True)
+
+    async def watch(self, recipient_username: str, buy_policy: dict[str, Any] | None = None,
+                    interval_sec: float = 20.0, jitter_sec: float = 5.0,
+                    state_flush_sec: float = 300.0, max_failures: int = 5) -> AsyncIterator[dict]:
+        """Долгоживущий режим: один браузер, повторные проходы раз в interval_sec ± jitter_sec.
+
+        buy_policy перечитывается на каждом проходе, так что вызывающий код может
+        обновлять его (например, остаток дневного лимита) между итерациями.
+        """
+        await self.start()
+        failures = 0
+        last_flush = time.monotonic()
+        need_reconnect = False
+        try:
+            while True:
+                try:
+                    # Переподключение — часть прохода: его сбой тоже расходует max_failures
+                    if need_reconnect:
+                        await self.reconnect()
+                        need_reconnect = False
+                    res = await self.scan_once(recipient_username, buy_policy)
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    logger.exception(f"Watch pass failed ({failures}/{max_failures}): {e}")
+                    if failures >= max_failures:
+                        raise
+                    await asyncio.sleep(min(60.0, 2.0 ** failures))
+                    need_reconnect = True
+                    continue
+
+                if self._page is not None and self._session_expired(self._page):
+                    logger.warning("Telegram Web session expired, reconnecting before the next pass")
+                    need_reconnect = True
+
+                if time.monotonic() - last_flush >= state_flush_sec:
+                    await self.save_state()
+                    last_flush = time.monotonic()
+
+                yield res
+
+                delay = max(0.0, interval_sec + random.uniform(-jitter_sec, jitter_sec))
+                await asyncio.sleep(delay)
+        finally:
+            await self.close(save_state=True)